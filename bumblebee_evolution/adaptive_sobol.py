@@ -0,0 +1,153 @@
+import argparse
+import numpy as np
+import pandas as pd
+from multiprocess import Pool, cpu_count
+from SALib.analyze import sobol
+from SALib.sample import saltelli
+from batch_run import make_batch, N_DAYS, DAILY_STEPS
+from analysis import PROBLEM, bootstrap_seed
+
+'''
+Adaptive global sensitivity analysis: the Saltelli sample is grown in rounds until the first-order and
+total Sobol indices have converged, instead of running a sample of fixed size.
+
+Every round doubles the number of base points N of the sample. The Saltelli sample of N points is the
+prefix of the sample of 2N points (the Sobol sequence is started at the same point), so a round only runs
+the new rows, and the seeds of the runs (spawned from the root seed by run index) do not change between
+rounds. After every round the indices are computed on all the rows so far; the sweep stops once every
+confidence interval is narrower than the threshold. The width is the full width of the interval, twice
+SALib's S1_conf and ST_conf, which are half-widths.
+
+    Si, history = adaptive_sobol(seed=0, threshold=0.05, log_path="results/adaptive_0.log")
+'''
+
+# start of the Sobol sequence, fixed so that the samples of all the rounds share their rows
+SKIP_VALUES = 1024
+
+
+def saltelli_rows(problem, N):
+    '''
+    Saltelli sample of N base points (a power of 2), without the second order rows, as a list of
+    parameter dicts for the batch runner. The sample of 2N points starts with the sample of N points.
+    '''
+    sample = saltelli.sample(problem, N, calc_second_order=False, skip_values=SKIP_VALUES)
+    return [dict(zip(problem["names"], (float(value) for value in row))) for row in sample]
+
+
+def interval_widths(Si):
+    '''
+    Widths of the confidence intervals of the first-order and total indices. SALib's S1_conf and ST_conf
+    are half-widths, the intervals are S1 +- S1_conf.
+    '''
+    return 2*np.concatenate([Si["S1_conf"], Si["ST_conf"]])
+
+
+def converged(Si, threshold):
+    '''
+    Whether all the confidence intervals of the first-order and total indices are narrower than the
+    threshold, a confidence that can not be computed (e.g. constant output) is not converged.
+    '''
+    widths = interval_widths(Si)
+    return bool(np.all(np.isfinite(widths)) and widths.max() < threshold)
+
+
+def _round_outputs(batch, replicates, output):
+    '''
+    Mean over the replicates of the final value of the output, for every row of the sample run by
+    the batch.
+    '''
+    runs, _ = batch._make_model_args_mp()
+    results = batch.get_collector_model()
+    Y = np.zeros(len(runs) // replicates)
+    for i, run in enumerate(runs):
+        Y[i // replicates] += results[batch._run_key(run)][output].iloc[-1]
+    return Y / replicates
+
+
+def adaptive_sobol(seed, threshold, log_path, problem=PROBLEM, output="Total Fertilized Queens",
+                   replicates=10, initial_N=64, max_N=4096, processes=None, N_days=N_DAYS,
+                   daily_steps=DAILY_STEPS, conf_level=0.95):
+    '''
+    Runs rounds of the sweep until the Sobol indices have converged, or the sample has max_N base points.
+
+    Args:
+        seed (int): root seed, the seed of every run is derived from it.
+        threshold (float): largest width allowed for the confidence intervals of S1 and ST (full widths,
+            see interval_widths).
+        log_path (str): result log of the runs, shared by all the rounds; running again with the same log
+            only runs the missing rows.
+        problem (dict): SALib problem, its names are parameters of the model.
+        output (str): model reporter of which the final value is analysed.
+        replicates (int): number of runs for every row of the sample, their mean is analysed.
+        initial_N (int): base points of the first round, a power of 2.
+        max_N (int): largest number of base points, a power of 2.
+        processes (int): number of processes, all the CPUs by default.
+        N_days, daily_steps: length of the runs.
+        conf_level (float): confidence level of the intervals.
+
+    Returns:
+        dict: indices of the last round (SALib ResultDict, with S1, S1_conf, ST, ST_conf).
+        pd.DataFrame: history of the indices, one line per round and parameter.
+    '''
+    if initial_N & (initial_N - 1) or max_N & (max_N - 1):
+        raise ValueError("initial_N and max_N must be powers of 2")
+
+    rows_per_point = problem["num_vars"] + 2
+    processes = processes or cpu_count()
+    Y = np.zeros(0)
+    history = []
+    N = initial_N
+    with Pool(processes) as pool:
+        while True:
+            variable_parameters = saltelli_rows(problem, N)
+            first_row = len(Y)
+            batch = make_batch(variable_parameters, seed, replicates, log_path,
+                               range(first_row*replicates, len(variable_parameters)*replicates),
+                               N_days=N_days, daily_steps=daily_steps, pool=pool,
+                               nr_processes=processes)
+            batch.run_all()
+            Y = np.concatenate([Y, _round_outputs(batch, replicates, output)])
+
+            Si = sobol.analyze(problem, Y, calc_second_order=False, conf_level=conf_level,
+                                seed=bootstrap_seed(seed))
+            for i, name in enumerate(problem["names"]):
+                history.append({"N": N, "runs": len(Y)*replicates, "parameter": name,
+                                "S1": Si["S1"][i], "S1_conf": Si["S1_conf"][i],
+                                "ST": Si["ST"][i], "ST_conf": Si["ST_conf"][i]})
+            print(f"N = {N}: largest confidence width {np.max(interval_widths(Si)):.4f}")
+
+            if converged(Si, threshold) or N >= max_N:
+                break
+            N *= 2
+    assert len(Y) == N*rows_per_point
+    return Si, pd.DataFrame(history)
+
+
+def main():
+
+    """
+    Runs the adaptive global sensitivity analysis. The runs are logged in results/adaptive_{seed}.log, so
+    an interrupted analysis can be resumed with the same seed, and the history of the indices is written
+    in results/adaptive_{seed}.csv.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', required=True, type=int, help='Enter your random seed.')
+    parser.add_argument('--threshold', default=0.05, type=float, help='Largest full width of the confidence intervals (twice S1_conf and ST_conf).')
+    parser.add_argument('--replicates', default=10, type=int, help='Number of runs for every set of parameters.')
+    parser.add_argument('--initial-N', default=64, type=int, help='Base points of the first round (a power of 2).')
+    parser.add_argument('--max-N', default=4096, type=int, help='Largest number of base points (a power of 2).')
+    parser.add_argument('--output', default="Total Fertilized Queens", help='Model reporter to analyse.')
+    parser.add_argument('--processes', type=int, help='Number of processes.')
+    args = parser.parse_args()
+
+    Si, history = adaptive_sobol(args.seed, args.threshold, f"results/adaptive_{args.seed}.log",
+                                 output=args.output, replicates=args.replicates, initial_N=args.initial_N,
+                                 max_N=args.max_N, processes=args.processes)
+    history.to_csv(f"results/adaptive_{args.seed}.csv", index=False)
+    print(Si.to_df()[0])
+    print(Si.to_df()[1])
+
+
+if __name__ == "__main__":
+    main()
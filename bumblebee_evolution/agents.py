@@ -1,4 +1,5 @@
 from mesa import Agent
+from encounters import role_probabilities, draw_roles
 import numpy as np
 
 '''
@@ -7,8 +8,10 @@ In this file, there are all the agents used for the project.
 2) Worker class
 3) Drone class
 4) Queen class
-5) Flower patch class
-6) Hive class
+5) Flower patch class, a view on one cell of the nectar field
+6) Nectar field class, the nectar of all the flower patches in the environment
+7) Drone index class, the drones of every cell by hive, for the queens looking for a mate
+8) Hive class
 '''
 
 class Bee(Agent):
@@ -28,94 +31,58 @@ class Bee(Agent):
 		self.health_level = 0 # health is empty upon initialization
 		self.isCollecting = False # false if the bee is not collecting, when it finds a good resource will be switched to true
 		self.last_resource = None # store the last good resource for the bee, since the bumblebees will always return there if it was a good resource
-		# dictionary with all the encounters made by a bee, in the dictionary, all the unique_ids will be stored in order to avoit to count the same bee twice
-		self.encounters = {
-			Worker:{"own_hive":set(), "other_hive":set()},
-			Drone:{"own_hive":set(), "other_hive":set()},
-			Queen:{"own_hive":set(), "other_hive":set()}
-		}
-
-	def update_encounters(self):
-		'''
-		This method should check and increment the encounters of a bee
-		'''
-		# if bee is in hive, don't record encounters
-		if self.pos in self.model.hive_positions:
-			return
-
-		cell_contents = self.model.grid.get_cell_list_contents((int(self.pos[0]), int(self.pos[1])))
-		cell_contents.remove(self)
-
-		for item in cell_contents:
-			if isinstance(item, Bee):
-				# check if bees originate from same hive
-				if item.hive == self.hive:
-					hive_category = "own_hive"
-				else:
-					hive_category = "other_hive"
-				# adjust self encounters dictionary
-				self.encounters[item.bee_type][hive_category].add(item.unique_id)
-				# adjust other bee's encounters dictionary
-				item.encounters[self.bee_type][hive_category].add(self.unique_id)
+		# the encounters of all the bees are stored in the model's EncounterStore, by unique_id, so the same bee is never counted twice
 
 	def random_move(self):
 		'''
 		This method should get the neighbouring cells (Moore's neighbourhood), select one, and move the agent to this cell.
 		'''
-		neighbouring_cells = self.model.grid.get_neighborhood(self.pos, moore=True)
-		if self.hive.pos in neighbouring_cells:
-			neighbouring_cells.remove(self.hive.pos)
+		# precomputed neighbourhood, without the own hive
+		neighbouring_cells = self.hive.neighbouring_cells[self.pos[0]][self.pos[1]]
 
 		# selecting new position
-		new_pos =  neighbouring_cells[int(self.model.random_move_values.pop()*len(neighbouring_cells))]
+		new_pos =  neighbouring_cells[int(self.model.random_moves.next()*len(neighbouring_cells))]
 
 		# moving the agent to the new position
-		self.model.grid.move_agent(self, tuple(new_pos))
-		self.update_encounters()
+		self.model.grid.move_agent(self, new_pos)
 
 	def check_cell_for_nectar(self, threshold=0): # it is possible to use a different treshold value in order to make a bee more selective
 		'''
 		This method should check if the cell is good enough to start collecting food.
 		'''
-		# content of the cell in the current position
-		cell_contents = self.model.grid.get_cell_list_contents((int(self.pos[0]), int(self.pos[1])))
-		for item in cell_contents:
-			if isinstance(item, FlowerPatch):
-				if item.nectar_units > threshold:
-					return item
-				else:
-					return False
-		return False
+		# nectar of the flower patch in the current position (0 if there is no flower patch)
+		return self.model.nectar_field.nectar[self.pos] > threshold
 
-	def collect(self, flower_patch):
+	def collect(self):
 		'''
 		This method should collect the nectar from the cell. The bee will collect all the nectar that it needs to eat or all the nectar in the flower
-
-		Args:
-			flower_patch(FlowerPatch): collect nectar from this flower patch
 		'''
-		amount_to_withdraw = min(self.nectar_needed - self.health_level, flower_patch.nectar_units)
+		nectar_field = self.model.nectar_field
+		amount_to_withdraw = min(self.nectar_needed - self.health_level, nectar_field.nectar[self.pos])
 		self.health_level += amount_to_withdraw
-		flower_patch.withdraw_nectar(amount_to_withdraw)
+		nectar_field.withdraw_nectar(self.pos, amount_to_withdraw)
 		self.isCollecting = True
+		# the next step is spent collecting, the bee is not stepped
+		self.model.schedule_bees_and_flower_patches.sleep(self, 1)
+
+	def on_wake(self):
+		'''
+		Called by the scheduler in place of the step spent collecting.
+		'''
+		self.isCollecting = False
 
 	def move_towards_hive(self):
 		'''
-		When called, this method will move the bee to its own hive one step at a time, as well as updating the encounters in the meantime
+		When called, this method will move the bee to its own hive one step at a time
 		'''
-		difference =  np.array(self.hive.pos) - np.array(self.pos) # find direction 
-		# moving the agent to the new position
-		self.model.grid.move_agent(self, (self.pos[0]+np.sign(difference[0]), self.pos[1]+np.sign(difference[1]))) 
-		# updating encounters
-		self.update_encounters() 
+		# moving the agent to the next cell on the way, see movement.NextHops
+		self.model.grid.move_agent(self, self.hive.homing_cells[self.pos[0]][self.pos[1]])
 
 	def move_towards_resource(self):
 		'''
 		Take one step towards the saved position of the last seen resource.
 		'''
-		difference =  np.array(self.last_resource) - np.array(self.pos)
-		self.model.grid.move_agent(self, (self.pos[0] + np.sign(difference[0]), self.pos[1] + np.sign(difference[1])))
-		self.update_encounters()
+		self.model.grid.move_agent(self, self.model.next_hops.towards(self.pos, self.last_resource))
 
 
 class Worker(Bee):
@@ -140,20 +107,22 @@ class Worker(Bee):
 		self.hive.nectar_units += self.stored_nectar
 		self.stored_nectar = 0
 
-	def collect(self, flower_patch):
+	def collect(self):
 		'''
-		This method should collect the nectar from a flower patch
-		Args: 
-			flower_patch (FlowerPatch): the flower patch agent on which the bee is.
+		This method should collect the nectar from the flower patch on which the bee is.
 		'''
+		nectar_field = self.model.nectar_field
 		# worker bees cannot directly replenish their own health, that happens in the hive at end of day
-		amount_to_withdraw = min(self.max_nectar-self.stored_nectar, flower_patch.nectar_units)
+		amount_to_withdraw = min(self.max_nectar-self.stored_nectar, nectar_field.nectar[self.pos])
 		# removing the nectar from the flower patch
-		flower_patch.withdraw_nectar(amount_to_withdraw)
+		nectar_field.withdraw_nectar(self.pos, amount_to_withdraw)
 		self.stored_nectar += amount_to_withdraw
 		# setting isCollecting to True, this is done because now that the bee collected the nectar, 
 		# will spend the next step frozen
 		self.isCollecting = True
+		# a full worker goes back to the hive instead, and is frozen after dropping the nectar
+		if self.stored_nectar < self.max_nectar:
+			self.model.schedule_bees_and_flower_patches.sleep(self, 1)
 
 	def step(self):
 		'''
@@ -177,10 +146,9 @@ class Worker(Bee):
 
 			# we have just executed a random move, or have reached last_resource
 			if not self.last_resource or self.pos == self.last_resource:
-				flower_patch = self.check_cell_for_nectar()
-				if flower_patch:
+				if self.check_cell_for_nectar():
 					# next timestep will be spent collecting
-					self.collect(flower_patch)
+					self.collect()
 				else:
 					self.last_resource = None
 
@@ -198,6 +166,14 @@ class Drone(Bee):
 		super().__init__(unique_id, model, pos, hive, nectar_needed)
 		self.bee_type = Drone
 
+	def random_move(self):
+		'''
+		Random move, keeping the drone index of the model up to date.
+		'''
+		old_pos = self.pos
+		super().random_move()
+		self.model.drone_index.move(self, old_pos)
+
 	def step(self):
 		"""
 		Drone behaviour in one step
@@ -212,9 +188,8 @@ class Drone(Bee):
 
 		# if the bee is hungry and there is nectar in the current cell, consume
 		if self.health_level < self.nectar_needed:
-			flower_patch = self.check_cell_for_nectar()
-			if flower_patch:
-				self.collect(flower_patch)
+			if self.check_cell_for_nectar():
+				self.collect()
 
 
 class Queen(Bee):
@@ -239,7 +214,7 @@ class Queen(Bee):
 		'''
 		self.hive.number_fertilized_queens += 1
 
-		# drone and queen are removed after mating
+		# drone and queen are removed after mating, the hive also removes the drone from the drone index
 		self.hive.remove_bee(self)
 		self.model.remove_agent(self)
 		drone.hive.remove_bee(drone)
@@ -249,8 +224,9 @@ class Queen(Bee):
 		'''
 		Defines queen behaviour for one timestep.
 		'''
-		# in hive and full on nectar, no action required
+		# in hive and full on nectar, no action required until the end of the day
 		if self.pos == self.hive.pos and self.health_level == self.nectar_needed:
+			self.model.schedule_bees_and_flower_patches.sleep(self)
 			return
 
 		# spend a timestep collecting resources, no movement
@@ -272,38 +248,49 @@ class Queen(Bee):
 			else:
 				self.random_move()
 
-		# gather cell contents after moving
-		cur_cell_contents = self.model.grid.get_cell_list_contents((int(self.pos[0]), int(self.pos[1])))
-		for item in cur_cell_contents:
-			if isinstance(item, Drone) and item.hive != self.hive:
-				self.mate(item)
-				return
+		# mate with a drone of another hive in the cell after moving, if there is any
+		drone = self.model.drone_index.foreign_drone(self.pos, self.hive)
+		if drone is not None:
+			self.mate(drone)
+			return
 
 		# did not mate, and we have just executed a random move, or have reached last_resource and need more nectar
 		if self.health_level < self.nectar_needed:
 			if not self.last_resource or self.pos == self.last_resource:
-				flower_patch = self.check_cell_for_nectar()
-				if flower_patch:
+				if self.check_cell_for_nectar():
 					# next timestep will be spent collecting
-					self.collect(flower_patch)
+					self.collect()
 				else:
 					self.last_resource = None
 
 
-class FlowerPatch(Agent):
-	def __init__(self, unique_id, model, pos, nectar_units):
+# roles of the bees, the index of a role is its code in array-based code (encounter counts, vectorized engine)
+ROLES = (Worker, Drone, Queen)
+
+
+class FlowerPatch:
+	def __init__(self, nectar_field, pos):
 		"""
+		Thin adapter exposing one cell of the nectar field as a flower patch (used by the visualisation).
+
 		Args:
-			unique_id: a unique id for the flower patch.
-			model: the model object.
+			nectar_field (NectarField): the nectar field of the model.
 			pos (tuple(int, int)): position of the flower patch in the environment.
-			nectar_units (float): nectar in the flower patch at the beginning of model run.
 		"""
-		super().__init__(unique_id, model)
+		self.nectar_field = nectar_field
 		self.pos = pos
-		self.max_nectar_units = nectar_units
-		self.nectar_units = nectar_units
-		self.replenishing_quantity = self.max_nectar_units / self.model.daily_steps
+
+	@property
+	def nectar_units(self):
+		return self.nectar_field.nectar[self.pos]
+
+	@property
+	def max_nectar_units(self):
+		return self.nectar_field.max_nectar[self.pos]
+
+	@property
+	def replenishing_quantity(self):
+		return self.nectar_field.replenish[self.pos]
 
 	def withdraw_nectar(self, nectar_drawn):
 		"""
@@ -311,14 +298,134 @@ class FlowerPatch(Agent):
 		Args:
 			nectar_drawn (float): nectar withdrawn by a bee.
 		"""
-		self.nectar_units -= nectar_drawn
+		self.nectar_field.withdraw_nectar(self.pos, nectar_drawn)
+
+
+class NectarField:
+	def __init__(self, width, height, daily_steps, hive_positions):
+		"""
+		Nectar of all the flower patches, stored as arrays indexed by position (0 where there is no flower patch).
+
+		Args:
+			width (int): width of the grid.
+			height (int): height of the grid.
+			daily_steps (int): number of steps in a day, a flower patch replenishes fully in one day.
+			hive_positions (list(tuple(int, int))): cells of the hives, where no flower patch can grow.
+		"""
+		self.daily_steps = daily_steps
+		self.nectar = np.zeros((width, height))
+		self.max_nectar = np.zeros((width, height))
+		self.replenish = np.zeros((width, height))
+
+		# flat indices of the cells that can hold a flower patch, each one gets a portion with equal probability
+		can_grow = np.ones((width, height), dtype=bool)
+		for pos in hive_positions:
+			can_grow[pos] = False
+		self.patch_cells = np.flatnonzero(can_grow)
+		self.portion_probabilities = np.full(len(self.patch_cells), 1/len(self.patch_cells))
+
+	def regenerate(self, rng, nectar):
+		"""
+		Redistributes nectar over the flower patches in place, each one starts full.
+
+		The nectar is split in one portion per cell that can hold a flower patch, and every portion goes to
+		one of these cells chosen uniformly at random (with replacement), so the portions of every cell
+		follow a multinomial distribution.
+		Args:
+			rng (np.random.Generator): random number generator of the model.
+			nectar (float): total nectar in the environment.
+		"""
+		num_portions = len(self.patch_cells)
+		portions = rng.multinomial(num_portions, self.portion_probabilities)
+		self.max_nectar.reshape(-1)[self.patch_cells] = portions*(nectar/num_portions)
+		self.nectar[:] = self.max_nectar
+		np.divide(self.max_nectar, self.daily_steps, out=self.replenish)
+
+	def withdraw_nectar(self, pos, nectar_drawn):
+		"""
+		Reduces the nectar quantity of a flower patch by the withdrawn amount.
+		Args:
+			pos (tuple(int, int)): position of the flower patch.
+			nectar_drawn (float): nectar withdrawn by a bee.
+		"""
+		self.nectar[pos] -= nectar_drawn
+
+	def flower_patches(self):
+		"""
+		Flower patches in the environment, as FlowerPatch adapters.
+		"""
+		return [FlowerPatch(self, (int(x), int(y))) for x, y in zip(*np.nonzero(self.max_nectar))]
 
 	def step(self):
 		"""
-		Actions to be taken for a flower patch at every time step. 
-		1. replenish the flower patch with nectar.
+		Actions to be taken for the flower patches at every time step. 
+		1. replenish all the flower patches with nectar.
 		"""
-		self.nectar_units = min(self.max_nectar_units, self.nectar_units + self.replenishing_quantity)
+		np.minimum(self.max_nectar, self.nectar + self.replenish, out=self.nectar)
+
+
+class DroneIndex:
+	def __init__(self):
+		'''
+		Drones of every cell, in order of arrival as in the cells of the grid, with their number per hive.
+		'''
+		self.cells = {} # position -> {unique_id: drone}
+		self.counts = {} # (position, hive) -> number of drones
+
+	def add(self, drone):
+		'''
+		Adds a drone at its current position.
+
+		Args:
+			drone (Drone): drone to add.
+		'''
+		self.cells.setdefault(drone.pos, {})[drone.unique_id] = drone
+		key = (drone.pos, drone.hive)
+		self.counts[key] = self.counts.get(key, 0) + 1
+
+	def remove(self, drone, pos=None):
+		'''
+		Removes a drone.
+
+		Args:
+			drone (Drone): drone to remove.
+			pos (tuple(int, int)): position of the drone in the index, by default its current position.
+		'''
+		pos = drone.pos if pos is None else pos
+		cell = self.cells[pos]
+		del cell[drone.unique_id]
+		if not cell:
+			del self.cells[pos]
+		key = (pos, drone.hive)
+		self.counts[key] -= 1
+		if not self.counts[key]:
+			del self.counts[key]
+
+	def move(self, drone, old_pos):
+		'''
+		Updates the index after a drone moved.
+
+		Args:
+			drone (Drone): drone that moved, its position is the new one.
+			old_pos (tuple(int, int)): position before moving.
+		'''
+		self.remove(drone, old_pos)
+		self.add(drone)
+
+	def foreign_drone(self, pos, hive):
+		'''
+		First drone to arrive in a cell among the ones of other hives, None if there is none.
+
+		Args:
+			pos (tuple(int, int)): position of the cell.
+			hive (Hive): hive of the queen.
+		'''
+		cell = self.cells.get(pos)
+		if not cell or len(cell) == self.counts.get((pos, hive), 0):
+			return None
+		for drone in cell.values():
+			if drone.hive is not hive:
+				return drone
 
 
 class Hive(Agent):
@@ -332,7 +439,10 @@ class Hive(Agent):
 		self.pos = pos
 		self.nectar_units = 0
 		self.bees = []
+		self.bee_counts = dict.fromkeys(ROLES, 0) # number of bees of every type, kept up to date by add_bee and remove_bee
 		self.number_fertilized_queens = 0
+		self.neighbouring_cells = None # neighbouring cells of every cell without the hive, set by the model (see movement.py)
+		self.homing_cells = None # next cell towards the hive from every cell, set by the model (see movement.py)
 
 	def add_bee(self, bee):
 		"""
@@ -341,6 +451,9 @@ class Hive(Agent):
 			bee (Bee): bee to be added to the hive.
 		"""
 		self.bees.append(bee)
+		self.bee_counts[bee.bee_type] += 1
+		if bee.bee_type is Drone:
+			self.model.drone_index.add(bee)
 
 	def remove_bee(self, bee):
 		"""
@@ -349,6 +462,9 @@ class Hive(Agent):
 			bee (Bee): bee to be removed from the hive.
 		"""
 		self.bees.remove(bee)
+		self.bee_counts[bee.bee_type] -= 1
+		if bee.bee_type is Drone:
+			self.model.drone_index.remove(bee)
 
 	def bees_to_hive(self):
 		'''
@@ -387,45 +503,29 @@ class Hive(Agent):
 		'''
 		Mutate bees.
 		'''
-		coeffs = self.model.parameters
-
-		for b in list(self.bees):
-			# find the probabilities of choosing each bee type based on encounters
-			agent_counts = {}
-			for bee_type, encounters in b.encounters.items():
-				agent_counts[(bee_type, "own")] = len(encounters['own_hive'])
-				agent_counts[(bee_type, "other")] = len(encounters['other_hive'])
-			
-			total_bees_encountered = sum(agent_counts.values())
-			
-			if total_bees_encountered == 0:
-				b.health_level = 0
-				continue
+		bees = list(self.bees)
+		if not bees:
+			return
 
-			# Computing the probabilities from the encounters made by a bee
-			agent_counts = {key:value/total_bees_encountered for key, value in agent_counts.items()}
-			agent_probs = {
-				Worker: coeffs["forager_royal_ratio"] * (1 - (coeffs["alpha"]*agent_counts[(Worker, "own")] + (1-coeffs["alpha"])*agent_counts[(Worker, "other")])),
-				Drone : ((1 - coeffs["forager_royal_ratio"])/2) * (1-(coeffs["alpha"]*agent_counts[(Drone, "own")]) + (1-coeffs["alpha"])*agent_counts[(Queen, "other")]),
-				Queen : ((1 - coeffs["forager_royal_ratio"])/2) * (1-(coeffs["alpha"]*agent_counts[(Queen, "own")]) + (1-coeffs["alpha"])*agent_counts[(Drone, "other")])
-			}
-
-			# normalise into probabilities by dividing by sum
-			prob_sum = sum(agent_probs.values())
-			if prob_sum == 0:
+		# find the probabilities of choosing each bee type based on encounters, for all the bees at once
+		counts = self.model.encounter_store.counts_of([b.unique_id for b in bees])
+		probabilities, changing = role_probabilities(counts, self.model.parameters)
+		new_roles = iter(draw_roles(self.model.rng, probabilities[changing]))
+
+		for b, change in zip(bees, changing):
+			# bees that met nobody (or have no valid role) stay the same
+			if not change:
 				b.health_level = 0
 				continue
-			agent_probs = {bee_type: prob/prob_sum for bee_type, prob in agent_probs.items()}
 
 			# add new agent and remove old one
-			new_agent = self.model.create_new_agent(
-				self.model.rng.choice(list(agent_probs.keys()),
-				p=list(agent_probs.values())), b.pos, b.hive)
+			new_agent = self.model.create_new_agent(ROLES[next(new_roles)], b.pos, b.hive)
 			new_agent.last_resource = b.last_resource
 			new_agent.isCollecting = False
 			b.hive.add_bee(new_agent)
-			self.model.remove_agent(b)
+			# removed from the hive first, the drone index needs the position
 			b.hive.remove_bee(b)
+			self.model.remove_agent(b)
 
 	def spawn_new_bees(self):
 		"""
@@ -0,0 +1,401 @@
+import argparse
+import hashlib
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from multiprocess import Pool, cpu_count
+from SALib.analyze import sobol
+from scipy import stats
+from result_store import ResultStore
+
+'''
+Analysis of the results of a sweep (batch_run.py), as in results/Global Sensitivity Analysis.ipynb, with
+grouped operations on one table of runs instead of loops over dicts of runs:
+
+    runs = load_final_values(["results/data_0", "results/data_1"])
+    statistics = point_statistics(runs)           # avg_std of the notebook, with confidence intervals
+    table = performance(statistics)               # performance of the notebook
+    best_strategies(statistics, 0.0, 0.1, top=10) # find_best_strategy of the notebook
+
+analyse does all of it, and caches the outputs by the checksums of the result files, so analysing the same
+results again only reads the cache.
+
+sobol_indices computes the Sobol indices of every column of the collected data, and of every day when the
+data is daily, in parallel; run as a script, it writes them next to the results:
+
+    python analysis.py results/data_0 --resamples 1000 --processes 8
+'''
+
+PARAMETERS = ["forager_royal_ratio", "growth_factor", "resource_variability"]
+OUTPUT = "Total Fertilized Queens"
+# low, medium and high resource variability
+RESOURCE_BANDS = [(0.0, 0.1), (0.1, 0.4), (0.4, 0.5)]
+# SALib problem of the global sensitivity analysis, with the bounds of the Saltelli sample
+PROBLEM = {
+    "num_vars": 3,
+    "names": PARAMETERS,
+    "bounds": [[0, 1], [0, 1], [0, 0.5]]
+}
+
+
+def _final_values_of_store(path, output):
+    store = ResultStore(path)
+    runs = pd.DataFrame({name: store.keys[:, store.key_names.index(name)] for name in PARAMETERS})
+    # the last row of every run
+    runs[output] = np.asarray(store.values[output][store.offsets[1:] - 1], dtype=np.float64)
+    return runs
+
+
+def _final_values_of_pickle(path, output):
+    with open(path, "rb") as f:
+        results = pickle.load(f)
+    keys = np.array([key[:len(PARAMETERS)] for key in results], dtype=np.float64).reshape(-1, len(PARAMETERS))
+    runs = pd.DataFrame(keys, columns=PARAMETERS)
+    runs[output] = np.array([frame[output].iloc[-1] for frame in results.values()], dtype=np.float64)
+    return runs
+
+
+def load_final_values(paths, output=OUTPUT):
+    '''
+    Final value of the output of every run of a sweep, one line per run with the parameters.
+
+    Args:
+        paths (str or list(str)): result stores (see result_store.py) or pickles of {key: DataFrame}
+            written by older versions of batch_run.py.
+        output (str): column of the collected data.
+    '''
+    if isinstance(paths, str):
+        paths = [paths]
+    return pd.concat([_final_values_of_store(path, output) if os.path.isdir(path)
+                      else _final_values_of_pickle(path, output) for path in paths], ignore_index=True)
+
+
+def point_statistics(runs, output=OUTPUT, conf_level=0.95):
+    '''
+    Statistics of the output over the replicates of every point of the sample.
+
+    Args:
+        runs (pd.DataFrame): runs, see load_final_values.
+        output (str): analysed column.
+        conf_level (float): confidence level of the interval of the mean.
+
+    Returns:
+        pd.DataFrame: indexed by the parameters, with the number of runs, the mean, the standard deviation
+            (of the population, as np.std) and the confidence interval of the mean (Student's t).
+    '''
+    grouped = runs.groupby(PARAMETERS, sort=False)[output]
+    statistics = pd.DataFrame({"runs": grouped.size(), "mean": grouped.mean(), "std": grouped.std(ddof=0)})
+    half_width = (stats.t.ppf((1 + conf_level) / 2, statistics["runs"] - 1)
+                  * grouped.std(ddof=1) / np.sqrt(statistics["runs"]))
+    statistics["ci_low"] = statistics["mean"] - half_width
+    statistics["ci_high"] = statistics["mean"] + half_width
+    return statistics
+
+
+def resource_band(resource_variability, bands=RESOURCE_BANDS):
+    '''
+    Index of the band of every resource variability. The bands are open on the left and closed on the
+    right, and the values outside all but the last band (including 0) fall in the last one, as in the
+    notebook.
+    '''
+    values = np.asarray(resource_variability)
+    band = np.full(len(values), len(bands) - 1)
+    for i, (low, high) in enumerate(bands[:-1]):
+        band[(low < values) & (values <= high)] = i
+    return band
+
+
+def performance(statistics, bin_count=10, bands=RESOURCE_BANDS):
+    '''
+    Mean performance of the strategies in bins of (forager_royal_ratio, growth_factor), for every band of
+    resource variability: the mean over the points of a bin and band of the mean output of every point.
+
+    Args:
+        statistics (pd.DataFrame): statistics of the points, see point_statistics.
+        bin_count (int): number of bins of forager_royal_ratio and of growth_factor, between 0 and 1.
+        bands (list(tuple)): bands of resource variability.
+
+    Returns:
+        pd.Series: indexed by (band, forager_royal_ratio bin, growth_factor bin), NaN for empty bins.
+    '''
+    points = statistics.index.to_frame(index=False)
+    bins = {name: np.minimum((points[name].to_numpy() * bin_count).astype(int), bin_count - 1)
+            for name in PARAMETERS[:2]}
+    table = statistics["mean"].groupby([resource_band(points[PARAMETERS[2]], bands),
+                                        bins[PARAMETERS[0]], bins[PARAMETERS[1]]]).mean()
+    full = pd.MultiIndex.from_product([range(len(bands)), range(bin_count), range(bin_count)],
+                                      names=["band"] + PARAMETERS[:2])
+    return table.reindex(full)
+
+
+def performance_matrix(table, band):
+    '''
+    Performance of one band as a matrix for the heatmaps, with the growth_factor bins as columns and the
+    forager_royal_ratio bins as rows, the highest at the top.
+    '''
+    return table.loc[band].unstack().to_numpy()[::-1]
+
+
+def best_bins(table, top=5):
+    '''
+    Best bins of (forager_royal_ratio, growth_factor) of every band of resource variability.
+
+    Returns:
+        dict: {band: pd.Series of the top mean performances, indexed by bin}
+    '''
+    return {band: table.loc[band].dropna().nlargest(top) for band in table.index.unique("band")}
+
+
+def best_strategies(statistics, min_resource_variability, max_resource_variability, top=1):
+    '''
+    Points of the sample with the highest mean output, in a range of resource variability.
+
+    Args:
+        statistics (pd.DataFrame): statistics of the points, see point_statistics.
+        min_resource_variability, max_resource_variability (float): range of resource variability,
+            both included.
+        top (int): number of points.
+
+    Returns:
+        pd.DataFrame: statistics of the best points, the best first.
+    '''
+    rv = statistics.index.get_level_values(PARAMETERS[2])
+    selected = statistics[(min_resource_variability <= rv) & (rv <= max_resource_variability)]
+    return selected.nlargest(top, "mean", keep="first")
+
+
+def checksum(path):
+    '''
+    SHA-256 of a file, or of all the files of a directory (e.g. a result store) with their names.
+    '''
+    digest = hashlib.sha256()
+    files = [path] if os.path.isfile(path) else sorted(
+        os.path.join(root, name) for root, _, names in os.walk(path) for name in names)
+    for file in files:
+        digest.update(os.path.relpath(file, path).encode())
+        with open(file, "rb") as f:
+            for block in iter(lambda: f.read(2**20), b""):
+                digest.update(block)
+    return digest.hexdigest()
+
+
+def analyse(paths, output=OUTPUT, bin_count=10, bands=RESOURCE_BANDS, cache_dir=None):
+    '''
+    Final values, point statistics and performance table of a sweep.
+
+    Args:
+        paths (str or list(str)): results of the sweep, see load_final_values.
+        output (str): analysed column.
+        bin_count (int), bands (list(tuple)): see performance.
+        cache_dir (str): directory of the cache of the analyses, none by default. An analysis is found
+            in the cache when the result files and the arguments are the same.
+
+    Returns:
+        dict: {"runs": runs, "statistics": point statistics, "performance": performance table}
+    '''
+    if isinstance(paths, str):
+        paths = [paths]
+    if cache_dir is not None:
+        key = hashlib.sha256(repr(([checksum(path) for path in paths], output, bin_count,
+                                   [tuple(band) for band in bands])).encode()).hexdigest()
+        cache_path = os.path.join(cache_dir, f"{key}.pickle")
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f:
+                return pickle.load(f)
+
+    runs = load_final_values(paths, output)
+    statistics = point_statistics(runs, output)
+    results = {"runs": runs, "statistics": statistics,
+               "performance": performance(statistics, bin_count, bands)}
+
+    if cache_dir is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        # written aside and renamed, so that an interrupted write is never read
+        with open(f"{cache_path}.tmp-{os.getpid()}", "wb") as f:
+            pickle.dump(results, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{cache_path}.tmp-{os.getpid()}", cache_path)
+    return results
+
+
+def bootstrap_seed(seed):
+    '''
+    Seed of the bootstrap of SALib's confidence intervals derived from a seed, as SALib ignores a seed of 0.
+    '''
+    return int(np.random.SeedSequence(seed).generate_state(1)[0]) or 1
+
+
+def load_runs(paths):
+    '''
+    Collected data of all the runs of a sweep, as arrays.
+
+    Args:
+        paths (str or list(str)): results of the sweep, see load_final_values; all the runs must have
+            the same number of rows (e.g. one per day).
+
+    Returns:
+        pd.DataFrame: parameters of every run, with its iteration, the index of its file in paths and its
+            position in the file (run).
+        dict: {column: (runs, rows) array of the collected values}
+    '''
+    if isinstance(paths, str):
+        paths = [paths]
+    keys, values = [], []
+    for file, path in enumerate(paths):
+        if os.path.isdir(path):
+            store = ResultStore(path)
+            lengths = np.diff(store.offsets)
+            if len(set(lengths)) > 1:
+                raise ValueError(f"the runs of {path} do not have the same number of rows")
+            keys.append(pd.DataFrame({name: store.keys[:, store.key_names.index(name)]
+                                      for name in PARAMETERS + ["iteration"]}))
+            values.append({column: np.asarray(store.values[column], dtype=np.float64).reshape(len(store), -1)
+                           for column in store.columns})
+        else:
+            with open(path, "rb") as f:
+                results = pickle.load(f)
+            frames = list(results.values())
+            # the iteration is the last element of the keys of the batch runner
+            keys.append(pd.DataFrame([key[:len(PARAMETERS)] + (key[-1],) for key in results],
+                                     columns=PARAMETERS + ["iteration"]))
+            values.append({column: np.stack([frame[column].to_numpy(dtype=np.float64) for frame in frames])
+                           for column in frames[0].columns})
+        keys[-1]["iteration"] = keys[-1]["iteration"].astype(np.int64)
+        keys[-1]["file"] = file
+        keys[-1]["run"] = np.arange(len(keys[-1]))
+    columns = [column for column in values[0] if all(column in part for part in values)]
+    return (pd.concat(keys, ignore_index=True),
+            {column: np.concatenate([part[column] for part in values]) for column in columns})
+
+
+def _sample_rows(keys, sample, names):
+    '''
+    Row of the sample of every run, see load_runs for the keys.
+
+    The runs of a file written by make_batch are in the order of the batch: every point of the sample, its
+    iterations one after the other. The row of such a run is given by its position, so that the points
+    appearing more than once in the sample (as Saltelli samples can) are told apart. The runs of the other
+    files (e.g. pickles of older versions, in the order the runs finished) are matched by their parameter
+    values, which requires distinct points.
+    '''
+    points = np.array([[float(point[name]) for name in names] for point in sample]).reshape(len(sample), -1)
+    rows = {tuple(point): i for i, point in enumerate(points)}
+    sample_row = np.zeros(len(keys), dtype=np.int64)
+    for file, runs in keys.groupby("file", sort=False):
+        iterations = runs["iteration"].max() + 1
+        position = runs["run"].to_numpy()
+        in_order = (len(runs) == len(sample) * iterations
+                    and np.array_equal(position % iterations, runs["iteration"].to_numpy())
+                    and np.array_equal(runs[names].to_numpy(), points[position // iterations]))
+        if in_order:
+            sample_row[runs.index] = position // iterations
+        elif len(rows) < len(sample):
+            raise ValueError(f"the runs of paths[{file}] are not in the order of the batch, they can not be "
+                             f"matched to the sample, which has points appearing more than once")
+        else:
+            sample_row[runs.index] = [rows[key] for key in runs[names].itertuples(index=False, name=None)]
+    return sample_row
+
+
+def _sobol_task(task):
+    '''
+    Sobol indices of one output, run in the pool of sobol_indices.
+    '''
+    column, day, problem, Y, calc_second_order, num_resamples, conf_level, seed = task
+    Si = sobol.analyze(problem, Y, calc_second_order=calc_second_order, num_resamples=num_resamples,
+                       conf_level=conf_level, seed=seed)
+    names = problem["names"]
+    rows = []
+    for order in ("S1", "ST"):
+        for i, name in enumerate(names):
+            rows.append((column, day, order, name, Si[order][i], Si[f"{order}_conf"][i]))
+    if calc_second_order:
+        for i in range(len(names)):
+            for j in range(i + 1, len(names)):
+                rows.append((column, day, "S2", f"{names[i]}, {names[j]}", Si["S2"][i, j], Si["S2_conf"][i, j]))
+    return rows
+
+
+def sobol_indices(paths, sample, problem=PROBLEM, columns=None, daily=True, calc_second_order=False,
+                  num_resamples=100, conf_level=0.95, average_replicates=False, processes=None, seed=0):
+    '''
+    First-order, total and optionally second-order Sobol indices of the collected data of a sweep, with
+    their bootstrap confidence intervals, computed in parallel for every column and day.
+
+    Args:
+        paths (str or list(str)): results of the sweep, see load_runs.
+        sample (list(dict)): Saltelli sample of the sweep, e.g. variable_parameters.pickle.
+        problem (dict): SALib problem of the sample.
+        columns (list(str)): columns to analyse, all by default.
+        daily (bool): whether to analyse every row of the runs (every day with daily data collection),
+            instead of the last one only.
+        calc_second_order (bool): whether to compute the second order indices, the sample must have
+            been made with calc_second_order=True.
+        num_resamples (int): number of bootstrap resamples of the confidence intervals.
+        conf_level (float): confidence level of the intervals.
+        average_replicates (bool): whether to analyse the mean of the replicates of every point of the
+            sample; by default the replicates are analysed as copies of the sample, one after the other,
+            as in results/Global Sensitivity Analysis.ipynb.
+        processes (int): number of processes, all the CPUs by default.
+        seed (int): seed of the bootstrap.
+
+    Returns:
+        pd.DataFrame: one line per column, day, order and parameter (pair of parameters for S2), with
+            the index and its confidence interval; day is the row of the runs, -1 for the last one only.
+    '''
+    keys, values = load_runs(paths)
+    columns = list(values) if columns is None else columns
+
+    # row of the sample and replicate of every run
+    sample_row = _sample_rows(keys, sample, problem["names"])
+    replicate = pd.Series(sample_row).groupby(sample_row).cumcount().to_numpy()
+    replicates = replicate.max() + 1
+    if len(sample_row) != len(sample) * replicates:
+        raise ValueError(f"{len(sample_row)} runs are not {replicates} replicates of the {len(sample)} points")
+
+    days = range(next(iter(values.values())).shape[1]) if daily else [-1]
+    tasks = []
+    for column in columns:
+        # (replicates, points, rows) values in the order of the sample
+        ordered = np.zeros((replicates, len(sample), values[column].shape[1]))
+        ordered[replicate, sample_row] = values[column]
+        Y = ordered.mean(axis=0) if average_replicates else ordered.reshape(-1, ordered.shape[2])
+        for day in days:
+            tasks.append((column, day, problem, np.ascontiguousarray(Y[:, day]), calc_second_order,
+                          num_resamples, conf_level, bootstrap_seed(seed)))
+
+    with Pool(processes or cpu_count()) as pool:
+        results = pool.map(_sobol_task, tasks, chunksize=1)
+    return pd.DataFrame([row for rows in results for row in rows],
+                        columns=["output", "day", "order", "parameter", "index", "conf"])
+
+
+def main():
+
+    """
+    Computes the Sobol indices of every column (and every day) of the results of a sweep, and writes them
+    in <first result path>.sobol.csv or the given file.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('paths', nargs='+', help='Result stores or pickles of the sweep.')
+    parser.add_argument('--sample', default='variable_parameters.pickle', help='Saltelli sample of the sweep.')
+    parser.add_argument('--resamples', default=100, type=int, help='Number of bootstrap resamples.')
+    parser.add_argument('--second-order', action='store_true', help='Compute the second order indices.')
+    parser.add_argument('--final', action='store_true', help='Only analyse the last row of every run.')
+    parser.add_argument('--average-replicates', action='store_true', help='Analyse the mean of the replicates.')
+    parser.add_argument('--processes', type=int, help='Number of processes.')
+    parser.add_argument('--seed', default=0, type=int, help='Seed of the bootstrap.')
+    parser.add_argument('--output', help='CSV file of the indices.')
+    args = parser.parse_args()
+
+    with open(args.sample, "rb") as f:
+        sample = pickle.load(f)
+    indices = sobol_indices(args.paths, sample, daily=not args.final, calc_second_order=args.second_order,
+                            num_resamples=args.resamples, average_replicates=args.average_replicates,
+                            processes=args.processes, seed=args.seed)
+    indices.to_csv(args.output or f"{args.paths[0].rstrip(os.sep)}.sobol.csv", index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,89 @@
 from batchrunner import BatchRunnerMP
 from model import BeeEvolutionModel
+from result_store import merge_results, load_telemetry
+from telemetry import slowest_regions
+from work_queue import WorkQueue
 from agents import *
 import argparse
 import pickle
+import shutil
+import os
+
+# length of the runs (the default of the model)
+N_DAYS, DAILY_STEPS = 30, 400
+
+
+def make_batch(variable_parameters, seed, replicates, log_path, subset=None, N_days=N_DAYS, daily_steps=DAILY_STEPS,
+			   pool=None, nr_processes=None):
+	"""
+	Batch runner of the sweep, see main.
+
+	Args:
+		variable_parameters (list(dict)): parameters of every point of the sample.
+		seed (int): root seed, the seed of every run is derived from it.
+		replicates (int): number of runs for every point.
+		log_path (str): result log of the runs.
+		subset (range): indices of the runs to do, all by default.
+		pool (Pool): pool of processes shared with other batches, by default the batch starts its own.
+		nr_processes (int): number of processes, all the CPUs by default.
+	"""
+	return BatchRunnerMP(BeeEvolutionModel,
+						nr_processes=nr_processes,
+						fixed_parameters={"N_days":N_days, "daily_steps":daily_steps},
+						iterations=replicates,
+						root_seed=seed,
+						subset=subset,
+						pool=pool,
+						variable_parameters=variable_parameters,
+						max_steps=N_days*daily_steps,
+						display_progress=True,
+						log_path=log_path)
+
+
+def run_queue(queue, variable_parameters, seed, replicates, chunk_size, **run_length):
+	"""
+	Runs chunks of chunk_size points of the sample, claimed from the work queue, until there is nothing
+	left to claim. Several workers can share the same queue directory.
+
+	Args:
+		queue (WorkQueue): queue of the chunks, created if needed.
+		variable_parameters, seed, replicates: see make_batch.
+		chunk_size (int): number of points of the sample in a chunk.
+	"""
+	queue.create((len(variable_parameters) + chunk_size - 1) // chunk_size)
+	chunk = queue.claim()
+	while chunk is not None:
+		first, last = chunk*chunk_size, min((chunk + 1)*chunk_size, len(variable_parameters))
+		batch = make_batch(variable_parameters, seed, replicates, queue.log_path(chunk),
+						range(first*replicates, last*replicates), **run_length)
+		batch.run_all()
+		batch.close()
+
+		# the store is written aside and renamed, another worker may have run the chunk too
+		results_path = queue.results_path(chunk)
+		tmp = f"{results_path}.tmp-{queue.worker}"
+		batch.save_collector_model(tmp)
+		try:
+			os.rename(tmp, results_path)
+		except OSError:
+			shutil.rmtree(tmp)
+		queue.complete(chunk)
+		chunk = queue.claim()
+
+
+def merge_queue(queue, path):
+	"""
+	Merges the results of all the chunks of a work queue in one result store.
+
+	Args:
+		queue (WorkQueue): queue of the chunks.
+		path (str): directory of the merged store.
+	"""
+	unfinished = queue.unfinished()
+	if unfinished:
+		raise SystemExit(f"chunks {unfinished} are not finished, run a worker on the queue again")
+	merge_results([queue.results_path(chunk) for chunk in queue.finished()], path)
+
 
 def main():
 
@@ -11,33 +92,59 @@ def main():
 	variable_parameters.pickle.
 
 	In that file there are all the set of parameters produced using the saltelli sample.
-	When clled, this file require to enter the random seed.
+	The results are written in the directory results/data_{seed}, read them with result_store.load_results.
+	When clled, this file require to enter the random seed, from which the seed of every run (parameter set
+	and replicate) is derived, and optionally the number of replicates.
+	Every finished run is logged in results/data_{seed}.log, if the script is interrupted running it
+	again with the same seed only runs the missing parameters.
+
+	With --queue, the sample is split in chunks shared through a directory, and the script can be started
+	on several machines with a shared filesystem; each one runs chunks until none is left. The chunks
+	of a worker that died are run again by another worker once their lease has expired. When all the
+	chunks are done, running the script with --queue and --merge writes results/data_{seed}.
+
+	With --report, the slowest regions of the parameter space in results/data_{seed} are printed, from the
+	telemetry recorded for every run (wall and CPU time, steps, peak number of bees and memory).
 	"""
 
 	parser = argparse.ArgumentParser()
 	parser.add_argument('--seed', required=True, help='Enter your random seed.')
+	parser.add_argument('--replicates', default=10, type=int, help='Number of runs for every set of parameters.')
+	parser.add_argument('--queue', help='Directory of a work queue shared by several workers.')
+	parser.add_argument('--chunk-size', default=64, type=int, help='Number of sets of parameters in a chunk of the queue.')
+	parser.add_argument('--lease', default=3600, type=float, help='Seconds without progress after which a chunk is run again.')
+	parser.add_argument('--merge', action='store_true', help='Merge the results of the queue.')
+	parser.add_argument('--report', action='store_true', help='Print the slowest regions of the parameters.')
 	args = parser.parse_args()
 	seed = int(args.seed)
 
 	
 	# Set the repetitions
-	replicates = 1
+	replicates = args.replicates
 	
+	if args.report:
+		telemetry = load_telemetry(f"results/data_{seed}")
+		print(slowest_regions(telemetry, ["forager_royal_ratio", "growth_factor", "resource_variability"]).to_string())
+		return
+
 	# load preset saltelli sample of parameters
 	with open("variable_parameters.pickle", "rb") as f:
 		variable_parameters = pickle.load(f)
 
-	batch = BatchRunnerMP(BeeEvolutionModel,
-						fixed_parameters={"seed":seed},
-						iterations=replicates,
-						variable_parameters=variable_parameters,
-						display_progress=True)
+	if args.queue:
+		queue = WorkQueue(args.queue, lease=args.lease)
+		if args.merge:
+			merge_queue(queue, f"results/data_{seed}")
+		else:
+			run_queue(queue, variable_parameters, seed, replicates, args.chunk_size)
+		return
+
+	batch = make_batch(variable_parameters, seed, replicates, f"results/data_{seed}.log")
 	batch.run_all()
+	batch.close()
 
-  # collection of the data
-	data = batch.get_collector_model()
-	with open(f"results/data_{seed}.pickle", 'wb') as f:
-		pickle.dump(data, f)
+  # collection of the data, as a columnar store (see result_store.py)
+	batch.save_collector_model(f"results/data_{seed}")
 
 if __name__ == "__main__":
 	main()
@@ -6,12 +6,18 @@ A single class to manage a batch run or parameter sweep of a given model.
 
 """
 import copy
+import io
+import os
+import pickle
 import random
 from itertools import product, count
 from multiprocess import Pool, cpu_count
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 from collections import OrderedDict
+from result_store import write_results
+from telemetry import measure_run, COLUMNS as TELEMETRY_COLUMNS
 
 
 class ParameterError(TypeError):
@@ -80,7 +86,9 @@ class FixedBatchRunner:
             iterations: The total number of times to run the model for each set
                 of parameters.
             max_steps: Upper limit of steps above which each run will be halted
-                if it hasn't halted on its own.
+                if it hasn't halted on its own; the runs of a model with N_days
+                and daily_steps attributes always reach their last day (see
+                step_limit).
             model_reporters: The dictionary of variables to collect on each run
                 at the end, with variable names mapped to a function to collect
                 them. For example:
@@ -117,6 +125,8 @@ class FixedBatchRunner:
         # Make Compatible with Python 3.5
         self.datacollector_model_reporters = OrderedDict()
         self.datacollector_agent_reporters = OrderedDict()
+        # performance of every run, see telemetry.py
+        self.telemetry = OrderedDict()
 
         self.display_progress = display_progress
 
@@ -163,11 +173,12 @@ class FixedBatchRunner:
 
     def run_iteration(self, kwargs, param_values, run_count):
         model = self.model_cls(**kwargs)
-        results = self.run_model(model)
+        results, telemetry = measure_run(self.run_model, model)
         if param_values is not None:
             model_key = tuple(param_values) + (run_count,)
         else:
             model_key = (run_count,)
+        self.telemetry[model_key] = telemetry
 
         if self.model_reporters:
             self.model_vars[model_key] = self.collect_model_vars(model)
@@ -201,7 +212,8 @@ class FixedBatchRunner:
         in your subclass.
 
         """
-        while model.running and model.schedule.steps < self.max_steps:
+        max_steps = step_limit(model, self.max_steps)
+        while model.running and model.schedule.steps < max_steps:
             model.step()
 
         if hasattr(model, "datacollector"):
@@ -229,10 +241,19 @@ class FixedBatchRunner:
 
     def get_model_vars_dataframe(self):
         """Generate a pandas DataFrame from the model-level variables
-        collected.
+        collected, with the telemetry of every run.
+        """
+        model_vars = OrderedDict(
+            (key, OrderedDict(values, **self.telemetry.get(key, {})))
+            for key, values in self.model_vars.items())
+        return self._prepare_report_table(model_vars)
+
+    def get_telemetry_dataframe(self):
+        """Generate a pandas DataFrame from the telemetry of every run,
+        see telemetry.py.
         """
 
-        return self._prepare_report_table(self.model_vars)
+        return self._prepare_report_table(self.telemetry)
 
     def get_agent_vars_dataframe(self):
         """Generate a pandas DataFrame from the agent-level variables
@@ -376,7 +397,9 @@ class BatchRunner(FixedBatchRunner):
             iterations: The total number of times to run the model for each
                 combination of parameters.
             max_steps: Upper limit of steps above which each run will be halted
-                if it hasn't halted on its own.
+                if it hasn't halted on its own; the runs of a model with N_days
+                and daily_steps attributes always reach their last day (see
+                step_limit).
             model_reporters: The dictionary of variables to collect on each run
                 at the end, with variable names mapped to a function to collect
                 them. For example:
@@ -412,10 +435,99 @@ class BatchRunner(FixedBatchRunner):
             )
 
 
+def step_limit(model, max_steps):
+    """
+    Number of steps after which a run is halted: max_steps, or the length of the run of a model of N_days
+    days of daily_steps steps (BeeEvolutionModel) if it is longer, so that the default max_steps does not
+    cut its runs before the end of the last day.
+
+    :param model: the model to run
+    :param max_steps: max_steps of the batch runner
+    """
+    N_days, daily_steps = getattr(model, "N_days", None), getattr(model, "daily_steps", None)
+    if N_days is None or daily_steps is None:
+        return max_steps
+    return max(max_steps, N_days*daily_steps)
+
+
+def spawn_seeds(root_seed, runs):
+    """
+    Independent seeds for a number of runs, the seed of the i-th run only depends on root_seed and i.
+
+    :param root_seed: int seed of np.random.SeedSequence
+    :param runs: number of runs
+    :return: list of int seeds
+    """
+    children = np.random.SeedSequence(root_seed).spawn(runs)
+    return [int(child.generate_state(1)[0]) for child in children]
+
+
+def _to_columns(df):
+    """
+    Compact, picklable record of a DataFrame: its index and one NumPy array per column.
+    """
+    return {"index": df.index, "columns": {name: df[name].to_numpy() for name in df.columns}}
+
+
+def _from_columns(record):
+    """
+    DataFrame from a record made by _to_columns.
+    """
+    return pd.DataFrame(record["columns"], index=record["index"])
+
+
+class ResultLog:
+    """
+    Append-only file of the finished runs of a sweep, one pickled (key, run summary) record per run,
+    so that an interrupted sweep can be resumed.
+    """
+
+    def __init__(self, path):
+        """
+        path: path of the log file, created at the first append if it does not exist.
+        """
+        self.path = path
+
+    def read(self):
+        """
+        Reads the whole log at once. A record cut by a crash at the end of the file is dropped, and
+        removed from the file.
+
+        :return: OrderedDict {key: run summary}, in order of completion
+        """
+        results = OrderedDict()
+        if not os.path.exists(self.path):
+            return results
+        with open(self.path, "rb") as f:
+            data = io.BytesIO(f.read())
+        end = 0
+        while end < len(data.getbuffer()):
+            try:
+                key, summary = pickle.load(data)
+            except (EOFError, pickle.UnpicklingError, ValueError, AttributeError):
+                break
+            results[key] = summary
+            end = data.tell()
+        if end < len(data.getbuffer()):
+            with open(self.path, "r+b") as f:
+                f.truncate(end)
+        return results
+
+    def append(self, key, summary):
+        """
+        Appends the record of a finished run, and makes sure it is on disk.
+        """
+        with open(self.path, "ab") as f:
+            pickle.dump((key, summary), f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+
+
 class BatchRunnerMP(BatchRunner):
     """Child class of BatchRunner, extended with multiprocessing support."""
 
-    def __init__(self, model_cls, nr_processes=None, **kwargs):
+    def __init__(self, model_cls, nr_processes=None, pool=None, log_path=None, root_seed=None, subset=None,
+                 **kwargs):
         """Create a new BatchRunnerMP for a given model with the given
         parameters.
 
@@ -423,6 +535,19 @@ class BatchRunnerMP(BatchRunner):
         nr_processes: int
                       the number of separate processes the BatchRunner
                       should start, all running in parallel.
+        pool: Pool
+              pool of processes shared with other runners, it is not closed by this runner.
+              By default the runner starts its own pool at the first parallel run_all, and keeps it
+              for the next ones until close is called.
+        log_path: str
+                  path of a ResultLog, every finished run is appended to it; the runs already in the log
+                  are skipped, and the results are read back from it.
+        root_seed: int
+                   if given, every run (parameter combination and iteration) gets its own seed parameter,
+                   spawned from np.random.SeedSequence(root_seed), so all the replicates run in one pool.
+        subset: sequence of int
+                indices of the runs to do, in the order of _make_model_args_mp (parameter combination,
+                then iteration), e.g. a shard of a sweep; the seeds do not depend on the subset.
         kwargs: the kwargs required for the parent BatchRunner class
         """
         if nr_processes is None:
@@ -434,14 +559,74 @@ class BatchRunnerMP(BatchRunner):
             self.processes = nr_processes
 
         super().__init__(model_cls, **kwargs)
-        self.pool = Pool(self.processes)
+        if root_seed is not None and "seed" in self.fixed_parameters:
+            raise ValueError("seed can not be a fixed parameter when root_seed is given")
+        self.root_seed = root_seed
+        self.subset = subset
+        self.pool = pool
+        self._owns_pool = pool is None
+        self.log = ResultLog(log_path) if log_path is not None else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close the pool of processes, if it was started by this runner."""
+        if self._owns_pool and self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+    def _get_pool(self):
+        """Pool of processes, started at the first call."""
+        if self.pool is None:
+            self.pool = Pool(self.processes)
+        return self.pool
+
+    def _chunksize(self, tasks):
+        """Number of runs sent at once to a process, about four chunks per process as in Pool.map."""
+        chunksize, extra = divmod(tasks, self.processes * 4)
+        return max(1, chunksize + bool(extra))
+
+    def _key_names(self):
+        """Name of every element of the keys of the runs (see _run_key)."""
+        names = list(self.parameters_list[0]) if self.parameters_list else []
+        names += [name for name in self.fixed_parameters if name not in names]
+        if self.root_seed is not None and "seed" not in names:
+            names.append("seed")
+        return names + ["iteration"]
+
+    def get_telemetry_dataframe(self):
+        """
+        Telemetry of every run (see telemetry.py), one line per run with the parameters of its key.
+        """
+        names = self._key_names()
+        return pd.DataFrame([OrderedDict(zip(names, key), **values) for key, values in self.telemetry.items()],
+                            columns=names + TELEMETRY_COLUMNS)
+
+    def save_collector_model(self, path):
+        """
+        Writes the DataCollector tables of the model (see get_collector_model) as a columnar result store,
+        with the telemetry of every run.
+
+        :param path: directory of the store, see result_store.py
+        """
+        write_results(path, self.get_collector_model(), self._key_names(), self.telemetry)
+
+    @staticmethod
+    def _run_key(iter_args):
+        """Key of the results of a run, the same as the param values returned by _run_wrappermp."""
+        return tuple(iter_args[1].values()) + (iter_args[3],)
 
     def _make_model_args_mp(self):
         """Prepare all combinations of parameter values for `run_all`
         Due to multiprocessing requirements of @StaticMethod takes different input, hence the similar function
         Returns:
             List of list with the form:
-            [[model_object, dictionary_of_kwargs, max_steps, iterations]]
+            [[model_object, dictionary_of_kwargs, max_steps, iterations, model_reporters, agent_reporters]]
         """
         total_iterations = self.iterations
         all_kwargs = []
@@ -455,15 +640,27 @@ class BatchRunnerMP(BatchRunner):
                 for iter in range(self.iterations):
                     kwargs_repeated = kwargs.copy()
                     all_kwargs.append(
-                        [self.model_cls, kwargs_repeated, self.max_steps, iter]
+                        [self.model_cls, kwargs_repeated, self.max_steps, iter,
+                         self.model_reporters, self.agent_reporters]
                     )
 
-        elif len(self.fixed_parameters):
+        elif len(self.fixed_parameters) or self.root_seed is not None:
             count = 1
-            kwargs = self.fixed_parameters.copy()
-            all_kwargs.append(kwargs)
+            for iter in range(self.iterations):
+                kwargs = self.fixed_parameters.copy()
+                all_kwargs.append(
+                    [self.model_cls, kwargs, self.max_steps, iter,
+                     self.model_reporters, self.agent_reporters]
+                )
+
+        if self.root_seed is not None:
+            for run, seed in zip(all_kwargs, spawn_seeds(self.root_seed, len(all_kwargs))):
+                run[1]["seed"] = seed
 
         total_iterations *= count
+        if self.subset is not None:
+            all_kwargs = [all_kwargs[i] for i in self.subset]
+            total_iterations = len(all_kwargs)
 
         return all_kwargs, total_iterations
 
@@ -478,20 +675,29 @@ class BatchRunnerMP(BatchRunner):
             iter_args[1] = key word arguments needed for model object
             iter_args[2] = maximum number of steps for model
             iter_args[3] = number of time to run model for stochastic/random variation with same parameters
+            iter_args[4] = model reporters, run at the end of the run
+            iter_args[5] = agent reporters, run at the end of the run
         :return:
             tuple of param values which serves as a unique key for model results
-            model object
+            summary of the run (see _summarise_run), so that the model itself is not sent back
         """
 
         model_i = iter_args[0]
         kwargs = iter_args[1]
         max_steps = iter_args[2]
         iteration = iter_args[3]
+        model_reporters = iter_args[4]
+        agent_reporters = iter_args[5]
+
+        def run(model):
+            limit = step_limit(model, max_steps)
+            while model.running and model.schedule.steps < limit:
+                model.step()
 
-        # instantiate version of model with correct parameters
+        # instantiate version of model with correct parameters; the Moore neighbourhoods are cached per
+        # process (see movement.moore_neighbourhoods), so the models after the first one of a worker are cheap
         model = model_i(**kwargs)
-        while model.running and model.schedule.steps < max_steps:
-            model.step()
+        _, telemetry = measure_run(run, model)
 
         # add iteration number to dictionary to make unique_key
         kwargs["iteration"] = iteration
@@ -499,33 +705,58 @@ class BatchRunnerMP(BatchRunner):
         # convert kwargs dict to tuple to  make consistent
         param_values = tuple(kwargs.values())
 
-        return param_values, model
+        return param_values, BatchRunnerMP._summarise_run(model, model_reporters, agent_reporters, telemetry)
+
+    @staticmethod
+    def _summarise_run(model, model_reporters, agent_reporters, telemetry=None):
+        """
+        Runs the reporters and extracts the DataCollector tables of a finished model, in the process
+        that ran it.
+
+        :return: dict with the model and agent variables (None without reporters), the
+            DataCollector tables as column records (None without a DataCollector), and the telemetry
+            of the run
+        """
+        summary = {"model_vars": None, "agent_vars": None,
+                   "collector_model": None, "collector_agents": None, "telemetry": telemetry}
+        if model_reporters:
+            summary["model_vars"] = OrderedDict(
+                (var, reporter(model)) for var, reporter in model_reporters.items())
+        if agent_reporters:
+            agent_vars = OrderedDict()
+            for agent in model.schedule._agents.values():
+                agent_vars[agent.unique_id] = OrderedDict(
+                    (var, getattr(agent, reporter)) for var, reporter in agent_reporters.items())
+            summary["agent_vars"] = agent_vars
+        if hasattr(model, "datacollector"):
+            if model.datacollector.model_reporters is not None:
+                summary["collector_model"] = _to_columns(model.datacollector.get_model_vars_dataframe())
+            if model.datacollector.agent_reporters is not None:
+                summary["collector_agents"] = _to_columns(model.datacollector.get_agent_vars_dataframe())
+        return summary
 
     def _result_prep_mp(self, results):
         """
         Helper Function
-        :param results: Takes results dictionary from Processpool and single processor debug run and fixes format to
-        make compatible with BatchRunner Output
+        :param results: Takes results dictionary of run summaries from Processpool and single processor debug run
+        and fixes format to make compatible with BatchRunner Output
         :updates model_vars and agents_vars so consistent across all batchrunner
         """
-        # Take results and convert to dictionary so dataframe can be called
-        for model_key, model in results.items():
+        # Take the run summaries and convert to dictionary so dataframe can be called
+        for model_key, summary in results.items():
             if self.model_reporters:
-                self.model_vars[model_key] = self.collect_model_vars(model)
+                self.model_vars[model_key] = summary["model_vars"]
             if self.agent_reporters:
-                agent_vars = self.collect_agent_vars(model)
-                for agent_id, reports in agent_vars.items():
+                for agent_id, reports in summary["agent_vars"].items():
                     agent_key = model_key + (agent_id,)
                     self.agent_vars[agent_key] = reports
-            if hasattr(model, "datacollector"):
-                if model.datacollector.model_reporters is not None:
-                    self.datacollector_model_reporters[
-                        model_key
-                    ] = model.datacollector.get_model_vars_dataframe()
-                if model.datacollector.agent_reporters is not None:
-                    self.datacollector_agent_reporters[
-                        model_key
-                    ] = model.datacollector.get_agent_vars_dataframe()
+            if summary["collector_model"] is not None:
+                self.datacollector_model_reporters[model_key] = _from_columns(summary["collector_model"])
+            if summary["collector_agents"] is not None:
+                self.datacollector_agent_reporters[model_key] = _from_columns(summary["collector_agents"])
+            # runs logged before the telemetry was recorded have none
+            if summary.get("telemetry") is not None:
+                self.telemetry[model_key] = summary["telemetry"]
 
         # Make results consistent
         if len(self.datacollector_model_reporters.keys()) == 0:
@@ -533,6 +764,13 @@ class BatchRunnerMP(BatchRunner):
         if len(self.datacollector_agent_reporters.keys()) == 0:
             self.datacollector_agent_reporters = None
 
+    def _store_result(self, results, params, summary):
+        """Keeps the summary of a finished run, appended to the log if there is one."""
+        if self.log is not None:
+            self.log.append(params, summary)
+        else:
+            results[params] = summary
+
     def run_all(self):
         """
         Run the model at all parameter combinations and store results,
@@ -544,25 +782,37 @@ class BatchRunnerMP(BatchRunner):
         # store results in ordered dictionary
         results = {}
 
+        # with a log, finished runs are written to disk as they come, and the logged ones are skipped
+        if self.log is not None:
+            keys = [self._run_key(run) for run in run_iter_args]
+            done = self.log.read().keys()
+            run_iter_args = [run for run, key in zip(run_iter_args, keys) if key not in done]
+
+        # the collector tables are set to None by a previous run_all without data
+        if self.datacollector_model_reporters is None:
+            self.datacollector_model_reporters = OrderedDict()
+        if self.datacollector_agent_reporters is None:
+            self.datacollector_agent_reporters = OrderedDict()
+
         if self.processes > 1:
-            with tqdm(total_iterations, disable=not self.display_progress) as pbar:
-                for params, model in self.pool.imap_unordered(
-                    self._run_wrappermp, run_iter_args
+            with tqdm(total=total_iterations, initial=total_iterations - len(run_iter_args),
+                      disable=not self.display_progress) as pbar:
+                for params, summary in self._get_pool().imap_unordered(
+                    self._run_wrappermp, run_iter_args, self._chunksize(len(run_iter_args))
                 ):
-                    results[params] = model
+                    self._store_result(results, params, summary)
                     pbar.update()
-
-                self._result_prep_mp(results)
         # For debugging model due to difficulty of getting errors during multiprocessing
         else:
             for run in run_iter_args:
                 params, model_data = self._run_wrappermp(run)
-                results[params] = model_data
-
-            self._result_prep_mp(results)
+                self._store_result(results, params, model_data)
 
-        # Close multi-processing
-        self.pool.close()
+        if self.log is not None:
+            # a single read of the log, keeping the runs of this sweep only
+            logged = self.log.read()
+            results = OrderedDict((key, logged[key]) for key in keys if key in logged)
+        self._result_prep_mp(results)
 
         return (
             getattr(self, "model_vars", None),
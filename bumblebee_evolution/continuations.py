@@ -0,0 +1,58 @@
+from multiprocess import get_context
+
+'''
+Continuations of a warmed-up model: many runs sharing the same first steps, each continuing with its own
+random numbers, e.g. replicates of one strategy that only differ after a common initial phase.
+
+    model = BeeEvolutionModel(0.5, 0.4, 0.3, seed=0)
+    for _ in range(5*model.daily_steps):
+        model.step()
+    results = run_continuations(model, batchrunner.spawn_seeds(0, 50), processes=8)
+'''
+
+# warmed-up model inherited by the forked workers
+_source = None
+
+
+def _finish(model):
+    '''
+    Runs a model to the end of the season, returns the DataFrame of its DataCollector.
+    '''
+    while model.running:
+        model.step()
+    return model.datacollector.get_model_vars_dataframe()
+
+
+def _run_forked(seed):
+    '''
+    Runs the continuation with the given seed in a forked worker, on the worker's copy-on-write copy
+    of the warmed-up model.
+    '''
+    _source.reseed(seed)
+    return _finish(_source)
+
+
+def run_continuations(model, seeds, processes=1):
+    '''
+    Runs one continuation of the model (see BeeEvolutionModel.fork) to the end of the season per seed.
+
+    Args:
+        model (BeeEvolutionModel): warmed-up model, it is not changed.
+        seeds (list(int)): seed of every continuation, e.g. from batchrunner.spawn_seeds.
+        processes (int): number of processes; with more than one, every continuation runs in a
+            process forked from this one, which shares the memory of the model until it changes it.
+
+    Returns:
+        list(pd.DataFrame): collected data of every continuation, in the order of the seeds.
+    '''
+    if processes <= 1:
+        return [_finish(model.fork(seed)) for seed in seeds]
+
+    global _source
+    _source = model
+    try:
+        # one task per worker, so that every continuation starts from an untouched copy of the model
+        with get_context("fork").Pool(processes, maxtasksperchild=1) as pool:
+            return pool.map(_run_forked, seeds, chunksize=1)
+    finally:
+        _source = None
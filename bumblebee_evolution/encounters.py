@@ -0,0 +1,183 @@
+import numpy as np
+
+'''
+Batched computation of the encounters between bees, and of the roles of the next generation.
+
+Once per step, the bees are bucketed by cell and all the pairs of bees sharing a cell are produced in a
+single pass over the sorted cells, instead of querying the grid after every move. The pairs of the day are
+kept in one EncounterStore for the whole population, and at the end of the day the roles of all the bees
+of a hive are drawn from their encounter counts in one batch.
+'''
+
+# columns of the encounter counts: (Worker, Drone, Queen) x (own hive, other hive), roles as in agents.ROLES
+ENCOUNTER_COLUMNS = 6
+
+
+def cooccurring_pairs(cells):
+    '''
+    Finds all the pairs of items that are in the same cell.
+
+    Args:
+        cells (np.ndarray): flat cell index of every item.
+
+    Returns:
+        tuple(np.ndarray, np.ndarray): indices (in cells) of the two items of every pair.
+    '''
+    cells = np.asarray(cells)
+    if cells.size < 2:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    order = np.argsort(cells, kind="stable")
+    sorted_cells = cells[order]
+
+    # every item is paired with the items after it in the same cell
+    last = np.ones(cells.size, dtype=bool)
+    last[:-1] = sorted_cells[1:] != sorted_cells[:-1]
+    group_end = np.flatnonzero(last)
+    end = np.repeat(group_end, np.diff(np.r_[-1, group_end]))
+    partners = end - np.arange(cells.size)
+    total = partners.sum()
+    first = np.repeat(np.arange(cells.size), partners)
+    block_start = np.repeat(np.cumsum(partners) - partners, partners)
+    second = first + 1 + np.arange(total) - block_start
+    return order[first], order[second]
+
+
+def pair_codes(first_ids, second_ids):
+    '''
+    Encodes pairs of unique ids as single integers, the same for (a, b) and (b, a).
+
+    Args:
+        first_ids (np.ndarray): unique id of the first bee of every pair.
+        second_ids (np.ndarray): unique id of the second bee of every pair.
+    '''
+    first_ids = np.asarray(first_ids, dtype=np.int64)
+    second_ids = np.asarray(second_ids, dtype=np.int64)
+    return (np.minimum(first_ids, second_ids) << 32) | np.maximum(first_ids, second_ids)
+
+
+class EncounterStore:
+    def __init__(self, buffer_size=1 << 20):
+        '''
+        Encounters of the whole population during one day.
+
+        The pairs of bees that met are kept as sorted, de-duplicated pair codes (see pair_codes), and the
+        role and hive of every bee alive during the day are kept as arrays sorted by unique id, so the
+        encounters of every bee can be counted with array operations at the end of the day.
+
+        Args:
+            buffer_size (int): number of recorded pairs after which duplicates are dropped.
+        '''
+        self.buffer_size = buffer_size
+        self.start_day(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+
+    def start_day(self, unique_ids, roles, hives):
+        '''
+        Forgets all the encounters and registers the bees of a new day.
+
+        Args:
+            unique_ids (np.ndarray): unique id of every bee.
+            roles (np.ndarray): role of every bee, its index in agents.ROLES.
+            hives (np.ndarray): index of the hive of every bee.
+        '''
+        unique_ids = np.asarray(unique_ids, dtype=np.int64)
+        order = np.argsort(unique_ids)
+        self.unique_ids = unique_ids[order]
+        self.roles = np.asarray(roles, dtype=np.int64)[order]
+        self.hives = np.asarray(hives, dtype=np.int64)[order]
+        self._pairs = [np.zeros(0, dtype=np.int64)]
+        self._buffered = 0
+        self._counts = None
+
+    def add(self, first_ids, second_ids):
+        '''
+        Records that the bees of every pair met, pairs already met during the day are counted once.
+
+        Args:
+            first_ids (np.ndarray): unique id of the first bee of every pair.
+            second_ids (np.ndarray): unique id of the second bee of every pair.
+        '''
+        if len(first_ids) == 0:
+            return
+        self._pairs.append(pair_codes(first_ids, second_ids))
+        self._buffered += len(first_ids)
+        self._counts = None
+        if self._buffered > self.buffer_size:
+            self._pairs = [self.pairs]
+            self._buffered = len(self._pairs[0])
+
+    @property
+    def pairs(self):
+        '''
+        Sorted codes of the distinct pairs of bees that met during the day.
+        '''
+        if len(self._pairs) > 1:
+            self._pairs = [np.unique(np.concatenate(self._pairs))]
+        return self._pairs[0]
+
+    def counts(self):
+        '''
+        Number of distinct bees met during the day, for every bee in order of unique id.
+
+        Returns:
+            np.ndarray: (bees, 6) counts, the columns are (Worker, own hive), (Worker, other hive),
+                (Drone, own hive), (Drone, other hive), (Queen, own hive), (Queen, other hive).
+        '''
+        if self._counts is None:
+            pairs = self.pairs
+            first = np.searchsorted(self.unique_ids, pairs >> 32)
+            second = np.searchsorted(self.unique_ids, pairs & 0xFFFFFFFF)
+            other = (self.hives[first] != self.hives[second]).astype(np.int64)
+            size = len(self.unique_ids)*ENCOUNTER_COLUMNS
+            counts = np.bincount(first*ENCOUNTER_COLUMNS + 2*self.roles[second] + other, minlength=size)
+            counts += np.bincount(second*ENCOUNTER_COLUMNS + 2*self.roles[first] + other, minlength=size)
+            self._counts = counts.reshape(len(self.unique_ids), ENCOUNTER_COLUMNS)
+        return self._counts
+
+    def counts_of(self, unique_ids):
+        '''
+        Encounter counts (see counts) of the given bees.
+
+        Args:
+            unique_ids (np.ndarray): unique ids of bees registered for the day.
+        '''
+        return self.counts()[np.searchsorted(self.unique_ids, unique_ids)]
+
+
+def role_probabilities(counts, parameters):
+    '''
+    Probabilities of the role of the next generation of every bee, from its encounters.
+
+    Args:
+        counts (np.ndarray): (bees, 6) encounter counts, see EncounterStore.counts.
+        parameters (dict): model parameters, with forager_royal_ratio and alpha.
+
+    Returns:
+        tuple(np.ndarray, np.ndarray): (bees, 3) probabilities of becoming a Worker, a Drone or a Queen,
+            and the mask of the bees with valid probabilities (the others met nobody, or got all zeros).
+    '''
+    ratio, alpha = parameters["forager_royal_ratio"], parameters["alpha"]
+    total = counts.sum(axis=1)
+    fraction = counts / np.maximum(total, 1)[:, None]
+    worker_own, worker_other, drone_own, drone_other, queen_own, queen_other = fraction.T
+    probabilities = np.column_stack((
+        ratio * (1 - (alpha*worker_own + (1-alpha)*worker_other)),
+        ((1 - ratio)/2) * (1-(alpha*drone_own) + (1-alpha)*queen_other),
+        ((1 - ratio)/2) * (1-(alpha*queen_own) + (1-alpha)*drone_other),
+    ))
+    prob_sum = probabilities.sum(axis=1)
+    valid = (total > 0) & (prob_sum > 0)
+    probabilities[valid] /= prob_sum[valid, None]
+    probabilities[~valid] = 0
+    return probabilities, valid
+
+
+def draw_roles(rng, probabilities):
+    '''
+    Draws one role per row of probabilities, with a single batch of random numbers.
+
+    Args:
+        rng (np.random.Generator): random number generator of the model.
+        probabilities (np.ndarray): (bees, roles) probabilities, each row sums to 1.
+    '''
+    draws = rng.random(len(probabilities))
+    return (draws[:, None] >= np.cumsum(probabilities, axis=1)[:, :-1]).sum(axis=1)
@@ -1,19 +1,31 @@
-from mesa.time import RandomActivation, BaseScheduler
-from mesa.datacollection import DataCollector
+from mesa.time import BaseScheduler
 from mesa.space import MultiGrid
-from collections import Counter
 from itertools import product
+import random
+import pickle
+import time
 from mesa import Model
 from tqdm import tqdm
 from agents import *
+from vectorized import VectorizedEngine
+from encounters import EncounterStore, cooccurring_pairs
+from movement import HiveNeighbourhoods, NextHops, RandomStream
+from scheduler import ActiveSetActivation
+from recorder import DailyRecorder
+from trajectory import TrajectoryRecorder
 
 
 class BeeEvolutionModel(Model):
+    # compare the bee counters with a full recount every time they are read, for tests
+    check_bee_counts = False
+    # once all the hives are extinct, skip the remaining days (see is_extinct), the output is the same
+    skip_extinct_days = True
+
     def __init__(self, forager_royal_ratio, growth_factor, resource_variability,
                  seed, alpha=0.5, width=25, height=25, num_hives=3,
                  initial_bees_per_hive=3,
                  daily_steps=400, N_days=30,
-                 daily_data_collection=False):
+                 daily_data_collection=False, vectorized=False, trajectory_path=None):
         """
         Args:
             forager_royal_ratio (float): coefficient for mutation
@@ -28,6 +40,10 @@ class BeeEvolutionModel(Model):
             daily_steps (int): number of steps to be run to simulate a day.
             N_days (int): number of days to run in a simulation
             daily_data_collection (boolean): whether to collect data daily
+            vectorized (boolean): whether to store the bees in arrays and step them in batches
+                (see vectorized.py) instead of stepping one agent per bee
+            trajectory_path (str): directory where the positions, roles and hives of the bees are written
+                after every step (see trajectory.py), by default they are not recorded
         """
         self.daily_data_collection = daily_data_collection
         self.N_days = N_days
@@ -44,42 +60,78 @@ class BeeEvolutionModel(Model):
         self.current_id = 0
         self.num_hives = num_hives
 
-        # initialise random number generator
+        # initialise random number generators, mesa's one as in Model.__new__ but owned by the model
+        # (Model.__new__ sets it on the class), so that it is part of snapshots
+        self._seed = seed
+        self.random = random.Random(seed)
         self.rng = np.random.default_rng(seed)
 
-        # default scheduler, used by batch runner for step counting
-        self.schedule = BaseScheduler(self) 
+        # array-backed engine, holding the bees instead of the agents
+        self.vectorized = vectorized
+        self.engine = VectorizedEngine(self) if vectorized else None
 
-        # create schedules
-        self.schedule_bees_and_flower_patches = RandomActivation(self)
+        # create schedules (flower patches are not agents, they live in the nectar field, which is
+        # replenished in a phase of the bee scheduler after the bees)
+        self.schedule_bees_and_flower_patches = ActiveSetActivation(self)
         self.schedule_hives = BaseScheduler(self)
 
-        # set up bees and hives
+        # default scheduler, used by batch runner for step counting
+        self.schedule = self.schedule_bees_and_flower_patches
+
+        # set up bees and hives, the number of bees of every type is kept up to date by
+        # create_new_agent and remove_agent (see count_bees)
+        self.bee_counts = dict.fromkeys(ROLES, 0)
+        self.drone_index = DroneIndex() # kept up to date by Hive.add_bee, Hive.remove_bee and Drone.random_move
         self.initial_bees_per_hive = initial_bees_per_hive
         self.initial_bee_type_ratio = {Drone:1/3, Worker:1/3, Queen:1/3}
         self.hives = self.setup_hives_and_bees()
+
+        # cheap statistics of the run, read by the batch runner (see telemetry.py): steps actually run,
+        # seconds spent in the end of day processing of the hives, and largest number of living bees
+        # (bees are only born at the end of a day, so it is checked then)
+        self.telemetry = {"steps": 0, "end_of_day_time": 0.0, "peak_bees": self.count_all_bees()}
         self.hive_positions = [h.pos for h in self.hives]
+        self.is_hive_cell = np.zeros((width, height), dtype=bool)
+        for pos in self.hive_positions:
+            self.is_hive_cell[pos] = True
 
-        # create list of random moves for speed up
-        self.random_move_values = list(self.rng.uniform(0, 1, size=sum([len(h.bees) for h in self.hives])*self.daily_steps))
+        # pairs of bees that met during the current day
+        self.encounter_store = EncounterStore()
+        self.start_encounter_day()
+
+        # neighbourhoods without the own hive, next cells towards the hives and resources,
+        # and random numbers for the random moves
+        self.neighbourhoods = HiveNeighbourhoods(width, height, self.hive_positions)
+        self.next_hops = NextHops(width, height, self.hive_positions)
+        for hive, neighbouring_cells, homing_cells in zip(self.hives, self.neighbourhoods.positions,
+                                                          self.next_hops.homing_positions):
+            hive.neighbouring_cells = neighbouring_cells
+            hive.homing_cells = homing_cells
+        self.random_moves = RandomStream(self.rng)
 
         # set up flower patches
+        self.nectar_field = NectarField(width, height, daily_steps, self.hive_positions)
         self.mean_nectar_units = self.get_env_nectar_needed() * 50
         self.setup_flower_patches()
 
+        # batch phases of every step, after the bees (all the bees are in the engine if vectorized)
+        if self.vectorized:
+            self.schedule.add_phase(self.engine.step)
+        else:
+            self.schedule.add_phase(self.update_encounters)
+        self.schedule.add_phase(self.nectar_field.step)
+        self.trajectory = TrajectoryRecorder(trajectory_path, self) if trajectory_path is not None else None
+        if self.trajectory is not None:
+            self.schedule.add_phase(self.trajectory.record)
+
         # data collection
         self.running = True
-        model_reporters = {"Total Workers": lambda m: len([agent for agent in m.schedule_bees_and_flower_patches.agents if isinstance(agent, Worker)]),
-                           "Total Queens": lambda m: len([agent for agent in m.schedule_bees_and_flower_patches.agents if isinstance(agent, Queen)]),
-                           "Total Drones": lambda m: len([agent for agent in m.schedule_bees_and_flower_patches.agents if isinstance(agent, Drone)]),
-                           "Total Fertilized Queens": lambda m: m.get_total_fertilized_queens()}
-
-        for hive_i, hive in enumerate(self.hives):
-            for bee_type in [Worker, Queen, Drone]:
-                model_reporters[f"{bee_type.__name__}s in Hive {hive_i}"] = (
-                    lambda m, b=bee_type, h=hive: m.get_bees_of_each_type(b, h))
-
-        self.datacollector = DataCollector(model_reporters=model_reporters)
+        # one row per day (the initial state, every day and the end of the simulation) or only the end,
+        # filled by daily_row
+        columns = ["Total Workers", "Total Queens", "Total Drones", "Total Fertilized Queens"]
+        for hive_i in range(len(self.hives)):
+            columns += [f"{bee_type.__name__}s in Hive {hive_i}" for bee_type in [Worker, Queen, Drone]]
+        self.datacollector = DailyRecorder(columns, N_days + 2 if daily_data_collection else 1, self.daily_row)
         if self.daily_data_collection:
             self.datacollector.collect(self)
 
@@ -88,15 +140,20 @@ class BeeEvolutionModel(Model):
         Creates all hives and bees. Then sets them up in the environment.
         """
         hives = []
-        hive_positions = [tuple(item) for item in self.rng.choice(list(self.grid_locations), size=self.num_hives, replace=False)]
+        hive_positions = [tuple(int(c) for c in item) for item in self.rng.choice(list(self.grid_locations), size=self.num_hives, replace=False)]
 
         for _, pos in enumerate(hive_positions):
             new_hive = self.create_new_agent(Hive, pos)
             hives.append(new_hive)
+            if self.vectorized:
+                hive_i = self.engine.add_hive(new_hive)
 
             # add bees to new hive
             for bee_class, ratio in self.initial_bee_type_ratio.items():
                 num_bees_of_type = max(1, int(ratio*self.initial_bees_per_hive))
+                if self.vectorized:
+                    self.engine.add_bees(np.full(num_bees_of_type, ROLES.index(bee_class)), hive_i)
+                    continue
                 for _ in range(num_bees_of_type):
                     new_bee = self.create_new_agent(bee_class, pos, new_hive)
                     new_hive.add_bee(new_bee)
@@ -106,6 +163,8 @@ class BeeEvolutionModel(Model):
         """
         Evaluates the nectar needed for the setting up the environment.
         """
+        if self.vectorized:
+            return self.engine.nectar_needed()
         nectar = 0
         for agent in self.schedule_bees_and_flower_patches.agents:
             if isinstance(agent, Bee):
@@ -114,25 +173,11 @@ class BeeEvolutionModel(Model):
 
     def setup_flower_patches(self):
         """
-        Creates all the flower patches in the environment.
+        Sets up the flower patches in the environment for a new day, reusing the nectar field in place.
         """
-        # construct set of cells not occupied by hives 
-        hives_pos = {hive.pos for hive in self.hives}
-        possible_flower_patch_locations = list(self.grid_locations - hives_pos)
-
-        # number of desired flower patches
-        num_flower_patches = self.height*self.width - len(hives_pos)
         nectar = max(0, self.rng.normal(self.mean_nectar_units, self.resource_variability*self.mean_nectar_units))
-        nectar_for_one_patch = nectar/num_flower_patches
-
-        # dictionary of flower patches and nectar quantities
-        patch_choices = [tuple(x) for x in self.rng.choice(possible_flower_patch_locations, size=num_flower_patches, replace=True)]
-        flower_patches = Counter(patch_choices)
+        self.nectar_field.regenerate(self.rng, nectar)
 
-        # create FlowerPatch agents
-        for pos, count in flower_patches.items():
-            self.create_new_agent(FlowerPatch, pos, nectar_for_one_patch*count)
-            
     def create_new_agent(self, *argv):
         '''
         Method that enables us to add agents of a given type.
@@ -141,6 +186,8 @@ class BeeEvolutionModel(Model):
         agent_type = argv[0]
         agent = agent_type(self.next_id(), self, *argv[1:])
         self.grid.place_agent(agent, agent.pos)
+        if agent_type in self.bee_counts:
+            self.bee_counts[agent_type] += 1
         if agent_type == Hive:
             self.schedule_hives.add(agent)
         else:
@@ -156,6 +203,8 @@ class BeeEvolutionModel(Model):
         '''
         # Remove agent
         self.grid.remove_agent(agent)
+        if isinstance(agent, Bee):
+            self.bee_counts[agent.bee_type] -= 1
         if isinstance(agent, Hive):
             self.schedule_hives.remove(agent)
         else:
@@ -166,46 +215,198 @@ class BeeEvolutionModel(Model):
         Method that steps every agent. 
         '''
         self.step_count += 1
+        self.telemetry["steps"] += 1
         self.schedule_bees_and_flower_patches.step()
         
         # end of day actions
         if self.step_count % self.daily_steps == 0:
+            if self.trajectory is not None:
+                self.trajectory.end_day()
             # create new flower patches
-            for agent in self.schedule_bees_and_flower_patches.agents:
-                if isinstance(agent, FlowerPatch):
-                    self.remove_agent(agent)
             self.setup_flower_patches()
-            self.schedule_hives.step()
+            start = time.perf_counter()
+            if self.vectorized:
+                self.engine.end_of_day()
+            else:
+                self.schedule_hives.step()
+                # health levels and positions have changed, the idle bees have something to do again
+                self.schedule_bees_and_flower_patches.wake_all()
+            self.telemetry["end_of_day_time"] += time.perf_counter() - start
+            self.telemetry["peak_bees"] = max(self.telemetry["peak_bees"], self.count_all_bees())
+            self.start_encounter_day()
             if self.daily_data_collection:
                 self.datacollector.collect(self)
 
-            # generate random move values for the next day
-            self.random_move_values = list(self.rng.uniform(0, 1, size=sum([len(h.bees) for h in self.hives])*self.daily_steps))
-            
+            # make room for at least one random move per bee
+            self.random_moves.reserve(len(self.encounter_store.unique_ids))
+
             # end of simulation
             if self.step_count == self.N_days*self.daily_steps:
                 self.datacollector.collect(self)
                 self.running = False
                 return
 
+            if self.skip_extinct_days and self.is_extinct():
+                self.skip_to_end()
+
+    def is_extinct(self):
+        '''
+        Whether the model can not change anymore: no bee is left, and no hive has nectar for growing new
+        bees, so all the reported values stay the same until the end.
+        '''
+        if any(self.count_bees(bee_type) for bee_type in ROLES):
+            return False
+        return all(hive.nectar_units*self.parameters["growth_factor"] <= 0 for hive in self.hives)
+
+    def skip_to_end(self):
+        '''
+        Jumps to the end of the simulation from the end of a day of an extinct model, collecting the same
+        data as the remaining days would have.
+        '''
+        while self.step_count < self.N_days*self.daily_steps:
+            self.step_count += self.daily_steps
+            if self.daily_data_collection:
+                self.datacollector.collect(self)
+        self.schedule.steps = self.schedule.time = self.step_count
+        self.datacollector.collect(self)
+        self.running = False
+
+    def update_encounters(self):
+        '''
+        Records the encounters of the step: the bees sharing a cell meet each other, except in the hives.
+        '''
+        bees = self.schedule_bees_and_flower_patches.agents
+        if len(bees) < 2:
+            return
+        positions = np.array([bee.pos for bee in bees], dtype=np.int64)
+        outside = np.flatnonzero(~self.is_hive_cell[positions[:, 0], positions[:, 1]])
+        first, second = cooccurring_pairs(positions[outside, 0]*self.height + positions[outside, 1])
+
+        unique_ids = np.array([bee.unique_id for bee in bees], dtype=np.int64)[outside]
+        self.encounter_store.add(unique_ids[first], unique_ids[second])
+
+    def start_encounter_day(self):
+        '''
+        Registers the current bees in the encounter store, forgetting the encounters of the previous day.
+        '''
+        if self.vectorized:
+            self.encounter_store.start_day(*self.engine.population())
+            return
+        bees = self.schedule_bees_and_flower_patches.agents
+        hive_index = {hive: i for i, hive in enumerate(self.hives)}
+        self.encounter_store.start_day([bee.unique_id for bee in bees],
+                                       [ROLES.index(bee.bee_type) for bee in bees],
+                                       [hive_index[bee.hive] for bee in bees])
+
+    def snapshot(self):
+        '''
+        Full state of the model: agents, nectar field, hive nectar, encounters of the day, collected data
+        and the state of the random number generators. See restore and fork.
+        '''
+        return pickle.dumps(self, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def restore(snapshot):
+        '''
+        Model in the state of a snapshot, it continues exactly as the model of the snapshot would have.
+
+        Args:
+            snapshot (bytes): state returned by snapshot.
+        '''
+        return pickle.loads(snapshot)
+
+    def reseed(self, seed):
+        '''
+        Replaces the random number generators with new ones, e.g. for a continuation of a snapshot.
+
+        Args:
+            seed (int): random seed
+        '''
+        self._seed = seed
+        self.random = random.Random(seed)
+        self.rng = np.random.default_rng(seed)
+        self.random_moves.rng = self.rng
+        self.random_moves.refill()
+
+    def fork(self, seed):
+        '''
+        Copy of the model in its current state, continuing with fresh random numbers.
+
+        Args:
+            seed (int): random seed of the continuation
+        '''
+        model = self.restore(self.snapshot())
+        model.reseed(seed)
+        return model
+
     def run_model(self):
         '''
         Method that runs the model for a specific amount of steps.
         '''
         for _ in tqdm(range(self.N_days)): 
+            # the model may have skipped to the end, see skip_to_end
+            if not self.running:
+                break
             for _ in range(self.daily_steps):
                 self.step()
 
+    def daily_row(self):
+        """
+        Values recorded by the datacollector, in the order of its columns.
+        """
+        row = [self.count_bees(bee_type) for bee_type in [Worker, Queen, Drone]]
+        row.append(self.get_total_fertilized_queens())
+        for hive in self.hives:
+            row += [self.count_bees(bee_type, hive) for bee_type in [Worker, Queen, Drone]]
+        return row
+
     def get_bees_of_each_type(self, bee_type, hive=None):
         """
-        Get the number of bees of the given type and optionally hive.
+        Get the number of bees of the given type and optionally hive, at any step.
 
         Args:
             bee_type (class type): type of bees
             hive (Hive): calculate bees of this hive only
         """
-        if self.step_count % self.daily_steps != 0:
-            return
+        return self.count_bees(bee_type, hive)
+
+    def count_bees(self, bee_type, hive=None):
+        """
+        Number of bees of the given type and optionally hive, at any step. Reads the counters kept up to
+        date when bees are added and removed; if check_bee_counts is set, they are compared with recount_bees.
+
+        Args:
+            bee_type (class type): type of bees
+            hive (Hive): count bees of this hive only
+        """
+        if self.vectorized:
+            count = self.engine.count(bee_type, hive)
+        elif hive:
+            count = hive.bee_counts[bee_type]
+        else:
+            count = self.bee_counts[bee_type]
+        if self.check_bee_counts:
+            expected = self.recount_bees(bee_type, hive)
+            if count != expected:
+                raise RuntimeError(f"{bee_type.__name__} counter is {count} but there are {expected} bees")
+        return count
+
+    def count_all_bees(self):
+        """
+        Number of living bees of all types, from the counters.
+        """
+        return sum(self.count_bees(bee_type) for bee_type in ROLES)
+
+    def recount_bees(self, bee_type, hive=None):
+        """
+        Counts the bees of the given type and optionally hive from scratch, to check the counters.
+
+        Args:
+            bee_type (class type): type of bees
+            hive (Hive): count bees of this hive only
+        """
+        if self.vectorized:
+            return self.engine.recount(bee_type, hive)
         if hive:
             return len([bee for bee in hive.bees if isinstance(bee, bee_type)])
         else:
@@ -213,7 +414,6 @@ class BeeEvolutionModel(Model):
 
     def get_total_fertilized_queens(self):
         """
-        Get the number of fertilized queens
+        Get the number of fertilized queens, at any step
         """
-        if self.step_count % self.daily_steps == 0:
-            return sum([h.number_fertilized_queens for h in self.hives])
\ No newline at end of file
+        return sum([h.number_fertilized_queens for h in self.hives])
\ No newline at end of file
@@ -0,0 +1,190 @@
+from functools import lru_cache
+import numpy as np
+
+'''
+Precomputed tables and random numbers used to move the bees.
+
+1) HiveNeighbourhoods: Moore neighbourhood of every cell, without the cell of the hive, for every hive
+2) NextHops: next cell on the way to the hive of every hive, and towards any cell
+3) RandomStream: buffer of random numbers for the random moves, consumed by index
+'''
+
+
+@lru_cache(maxsize=None)
+def moore_neighbourhoods(width, height):
+    """
+    Moore neighbourhood of every cell, in the order of MultiGrid.get_neighborhood. Cached per grid size, so
+    that the models built by the same process share it.
+
+    Args:
+        width (int): width of the grid.
+        height (int): height of the grid.
+
+    Returns:
+        tuple: positions[x][y], the tuple of neighbouring positions, and the CSR-style arrays counts and
+            cells (see HiveNeighbourhoods), both read-only.
+    """
+    positions = tuple(tuple(tuple((x + dx, y + dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                                  if (dx, dy) != (0, 0) and 0 <= x + dx < width and 0 <= y + dy < height)
+                            for y in range(height))
+                      for x in range(width))
+    counts = np.array([len(neighbours) for column in positions for neighbours in column], dtype=np.int64)
+    cells = np.array([nx*height + ny for column in positions for neighbours in column for nx, ny in neighbours],
+                     dtype=np.int64)
+    counts.flags.writeable = False
+    cells.flags.writeable = False
+    return positions, counts, cells
+
+
+class HiveNeighbourhoods:
+    def __init__(self, width, height, hive_positions):
+        """
+        Neighbouring cells of every cell for the bees of every hive, stored CSR-style: the neighbours of
+        cell c for hive h are cells[offsets[r]:offsets[r + 1]] with r = h*width*height + c, and c = x*height + y.
+        The neighbours are in the order of MultiGrid.get_neighborhood, and the own hive is excluded.
+
+        Args:
+            width (int): width of the grid.
+            height (int): height of the grid.
+            hive_positions (list(tuple(int, int))): position of every hive.
+        """
+        self.width = width
+        self.height = height
+        # only the neighbourhoods of the cells around a hive differ from the plain Moore neighbourhoods
+        base_positions, base_counts, base_cells = moore_neighbourhoods(width, height)
+        row = np.repeat(np.arange(width*height), base_counts)
+        counts = []
+        cells = []
+        # positions[h][x][y] is the tuple of neighbouring positions, for the agents
+        self.positions = []
+        for hive_pos in hive_positions:
+            hive_pos = (int(hive_pos[0]), int(hive_pos[1]))
+            is_hive = base_cells == hive_pos[0]*height + hive_pos[1]
+            counts.append(base_counts - np.bincount(row[is_hive], minlength=width*height))
+            cells.append(base_cells[~is_hive])
+            hive_positions_table = [list(column) for column in base_positions]
+            for x, y in base_positions[hive_pos[0]][hive_pos[1]]:
+                hive_positions_table[x][y] = tuple(pos for pos in base_positions[x][y] if pos != hive_pos)
+            self.positions.append(hive_positions_table)
+        counts = np.concatenate(counts) if counts else np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.offsets[1:])
+        self.cells = np.concatenate(cells) if cells else np.zeros(0, dtype=np.int64)
+
+    def random_neighbours(self, hive, x, y, draws):
+        """
+        Picks one neighbouring cell for every bee.
+
+        Args:
+            hive (np.ndarray): hive index of every bee.
+            x, y (np.ndarray): position of every bee.
+            draws (np.ndarray): uniform random number in [0, 1) for every bee.
+
+        Returns:
+            tuple(np.ndarray, np.ndarray): the new position of every bee.
+        """
+        row = hive*(self.width*self.height) + x*self.height + y
+        start = self.offsets[row]
+        chosen = start + (draws*(self.offsets[row + 1] - start)).astype(np.int64)
+        cells = self.cells[chosen]
+        return cells // self.height, cells % self.height
+
+
+class NextHops:
+    def __init__(self, width, height, hive_positions):
+        """
+        Next cell of a bee moving one step (diagonals included) towards a target cell. The steps towards
+        the hives are precomputed for every cell, as arrays for the vectorized engine and as tuples of
+        plain ints for the agents, so that grid positions never hold NumPy scalars.
+
+        Args:
+            width (int): width of the grid.
+            height (int): height of the grid.
+            hive_positions (list(tuple(int, int))): position of every hive.
+        """
+        size = max(width, height)
+        # sign[d] is the sign of a difference d, negative differences index from the end of the list
+        self.sign = [0] + [1]*(size - 1) + [-1]*(size - 1)
+        xs, ys = np.meshgrid(np.arange(width), np.arange(height), indexing="ij")
+        hive_x = np.array([int(pos[0]) for pos in hive_positions], dtype=np.int64)
+        hive_y = np.array([int(pos[1]) for pos in hive_positions], dtype=np.int64)
+        # homing_x[h, x, y], homing_y[h, x, y] is the next cell from (x, y) towards hive h
+        self.homing_x = xs + np.sign(hive_x[:, None, None] - xs)
+        self.homing_y = ys + np.sign(hive_y[:, None, None] - ys)
+        # homing_positions[h][x][y] is the same cell as a tuple, for the agents
+        self.homing_positions = [[list(zip(column_x, column_y)) for column_x, column_y in zip(hx.tolist(), hy.tolist())]
+                                 for hx, hy in zip(self.homing_x, self.homing_y)]
+
+    def towards(self, pos, target):
+        """
+        Next cell from pos towards target.
+
+        Args:
+            pos (tuple(int, int)): current position.
+            target (tuple(int, int)): position to move towards.
+        """
+        x, y = pos
+        return (x + self.sign[target[0] - x], y + self.sign[target[1] - y])
+
+    def homing(self, hive, x, y):
+        """
+        Next cell towards their hive for many bees at once.
+
+        Args:
+            hive (np.ndarray): hive index of every bee.
+            x, y (np.ndarray): position of every bee.
+
+        Returns:
+            tuple(np.ndarray, np.ndarray): the new position of every bee.
+        """
+        return self.homing_x[hive, x, y], self.homing_y[hive, x, y]
+
+
+class RandomStream:
+    def __init__(self, rng, size=4096):
+        """
+        Uniform random numbers in [0, 1), drawn in blocks from the model's generator and consumed by index.
+
+        Args:
+            rng (np.random.Generator): random number generator of the model.
+            size (int): number of random numbers drawn at once.
+        """
+        self.rng = rng
+        self.buffer = np.empty(size)
+        self.refill()
+
+    def refill(self):
+        """
+        Draws a new block of random numbers.
+        """
+        self.rng.random(out=self.buffer)
+        self.index = 0
+
+    def reserve(self, size):
+        """
+        Grows the block to at least size random numbers, e.g. one per bee when the population grows.
+        """
+        if size > len(self.buffer):
+            self.buffer = np.empty(max(size, 2*len(self.buffer)))
+            self.refill()
+
+    def next(self):
+        """
+        Returns the next random number.
+        """
+        if self.index == len(self.buffer):
+            self.refill()
+        value = self.buffer[self.index]
+        self.index += 1
+        return value
+
+    def take(self, count):
+        """
+        Returns an array with the next count random numbers.
+        """
+        if self.index + count > len(self.buffer):
+            self.reserve(count)
+            self.refill()
+        values = self.buffer[self.index:self.index + count].copy()
+        self.index += count
+        return values
@@ -0,0 +1,140 @@
+import argparse
+import json
+import os
+import numpy as np
+from batch_run import make_batch, N_DAYS, DAILY_STEPS
+from result_store import ResultStore
+
+'''
+One-factor-at-a-time (OFAT) sensitivity analysis: every variable goes through a grid of values while the
+others stay at their nominal value.
+
+Every grid contains the nominal value of its variable, so all the grids go through the nominal point. The
+points of all the grids are run in a single batch, and a point in several grids (the nominal point) is run
+only once. The results are written as a result store
+(see result_store.py), with the problem in ofat.json:
+
+    run_ofat("results/ofat_20", seed=20, replicates=10, distinct_samples=10)
+    data = load_ofat("results/ofat_20")       # {variable: DataFrame of its runs}
+    summary = ofat_summary(data)              # {variable: mean and std of the output by value}
+'''
+
+PROBLEM = {
+    "num_vars": 4,
+    "names": ["alpha", "forager_royal_ratio", "growth_factor", "resource_variability"],
+    "bounds": [[0.0, 1.0], [0.0, 1.0], [0.0, 1.0], [0, 0.5]],
+    "nominal_value": [0.5, 0.5, 0.5, 0.25]
+}
+
+
+def ofat_points(problem, distinct_samples):
+    '''
+    Points of the OFAT grids, each one once: the nominal point, then for every variable the evenly
+    spaced values within its bounds, the others at their nominal value.
+
+    Args:
+        problem (dict): variables, with their bounds and nominal values.
+        distinct_samples (int): number of values of every variable, evenly spaced within its bounds,
+            besides the nominal value.
+
+    Returns:
+        list(dict): parameters of every point, in the order of the variables then of the values.
+    '''
+    nominal = dict(zip(problem["names"], problem["nominal_value"]))
+    points = {tuple(nominal.values()): dict(nominal)}
+    for name, bounds in zip(problem["names"], problem["bounds"]):
+        for value in np.linspace(*bounds, num=distinct_samples):
+            point = dict(nominal, **{name: float(value)})
+            points.setdefault(tuple(point.values()), point)
+    return list(points.values())
+
+
+def run_ofat(path, seed, replicates, distinct_samples, problem=PROBLEM, N_days=N_DAYS, daily_steps=DAILY_STEPS,
+             nr_processes=None):
+    '''
+    Runs the OFAT sweep and writes its results.
+
+    Args:
+        path (str): directory of the result store; the runs are logged in <path>.log, running again with
+            the same path only runs the missing points.
+        seed (int): root seed, the seed of every run is derived from it.
+        replicates (int): number of runs of every point.
+        distinct_samples (int): number of values of every variable, besides the nominal value.
+        problem (dict): variables, with their bounds and nominal values.
+        N_days, daily_steps: length of the runs.
+        nr_processes (int): number of processes, all the CPUs by default.
+    '''
+    points = ofat_points(problem, distinct_samples)
+    print(f"{len(points)} points instead of {problem['num_vars']*(distinct_samples + 1)} "
+          f"(the nominal point is shared by all the variables), {len(points)*replicates} runs")
+    batch = make_batch(points, seed, replicates, f"{path}.log", N_days=N_days, daily_steps=daily_steps,
+                       nr_processes=nr_processes)
+    batch.run_all()
+    batch.close()
+    batch.save_collector_model(path)
+    with open(os.path.join(path, "ofat.json"), "w") as f:
+        json.dump({"problem": problem, "distinct_samples": distinct_samples}, f)
+
+
+def load_ofat(path):
+    '''
+    Runs of every variable of an OFAT sweep, the runs of a point in several grids are in all of them.
+
+    Args:
+        path (str): directory of the result store written by run_ofat.
+
+    Returns:
+        dict: {variable: DataFrame of the runs with the other variables at their nominal value, one line
+            per collected row, see ResultStore.to_dataframe}
+    '''
+    store = ResultStore(path)
+    with open(os.path.join(path, "ofat.json")) as f:
+        problem = json.load(f)["problem"]
+    nominal = dict(zip(problem["names"], problem["nominal_value"]))
+    return {name: store.to_dataframe(store.find(**{other: value for other, value in nominal.items()
+                                                   if other != name}))
+            for name in problem["names"]}
+
+
+def ofat_summary(data, output="Total Fertilized Queens"):
+    '''
+    Mean and standard deviation of the final value of the output over the runs of every value of every
+    variable, as plotted in sensitivity_analysis.ipynb.
+
+    Args:
+        data (dict): runs of every variable, see load_ofat.
+        output (str): column of the collected data.
+
+    Returns:
+        dict: {variable: DataFrame with the values of the variable, Mean and Std}
+    '''
+    summary = {}
+    for name, runs in data.items():
+        # the last row of every run
+        final = runs[runs["Row"] == runs.groupby(["seed", "iteration"])["Row"].transform("max")]
+        grouped = final.groupby(name)[output]
+        summary[name] = grouped.agg(Mean="mean", Std="std").reset_index()
+    return summary
+
+
+def main():
+
+    """
+    Runs the OFAT sensitivity analysis, the results are written in results/ofat_{seed}.
+    """
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--seed', required=True, type=int, help='Enter your random seed.')
+    parser.add_argument('--replicates', default=10, type=int, help='Number of runs for every set of parameters.')
+    parser.add_argument('--samples', default=10, type=int, help='Number of values of every variable, besides its nominal value.')
+    parser.add_argument('--days', default=N_DAYS, type=int, help='Number of days of a run.')
+    parser.add_argument('--daily-steps', default=DAILY_STEPS, type=int, help='Number of steps of a day.')
+    parser.add_argument('--processes', type=int, help='Number of processes.')
+    args = parser.parse_args()
+
+    run_ofat(f"results/ofat_{args.seed}", args.seed, args.replicates, args.samples, N_days=args.days,
+             daily_steps=args.daily_steps, nr_processes=args.processes)
+
+
+if __name__ == "__main__":
+    main()
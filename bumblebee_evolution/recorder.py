@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+'''
+Recorder of the daily data of the model, used in place of mesa's DataCollector.
+
+The rows are written in a NumPy array allocated when the model is built, from the bee counters of the model
+(one call per row instead of one reporter per column), and the DataFrame is a view of the array. The
+recorder has the parts of the DataCollector interface used by the batch runner, run.py and the charts of
+visualisation.py: collect, get_model_vars_dataframe, model_vars, model_reporters and agent_reporters.
+'''
+
+
+class DailyRecorder:
+    def __init__(self, columns, rows, row):
+        """
+        Args:
+            columns (list(str)): names of the recorded values.
+            rows (int): number of rows allocated, the array doubles if more rows are collected.
+            row (callable): function without arguments returning the values of a row, as integers.
+        """
+        self.columns = list(columns)
+        self.row = row
+        self.data = np.zeros((rows, len(self.columns)), dtype=np.int64)
+        self.rows = 0
+        # column of every value; no agent data, as a DataCollector without agent reporters
+        self.model_reporters = {column: j for j, column in enumerate(self.columns)}
+        self.agent_reporters = None
+
+    def collect(self, model):
+        """
+        Records a row.
+
+        Args:
+            model (Model): the model, for compatibility with DataCollector.collect (the row function
+                reads it already).
+        """
+        if self.rows == len(self.data):
+            self.data = np.concatenate([self.data, np.zeros_like(self.data[:max(1, self.rows)])])
+        self.data[self.rows] = self.row()
+        self.rows += 1
+
+    @property
+    def model_vars(self):
+        """
+        Recorded values by column, as in DataCollector.model_vars: lists of Python ints, so that they can be
+        encoded as JSON (e.g. by the ChartModules of visualisation.py).
+        """
+        return {column: self.data[:self.rows, j].tolist() for j, column in enumerate(self.columns)}
+
+    def get_model_vars_dataframe(self):
+        """
+        DataFrame of the recorded rows, one row per collect. It is a view of the array of the recorder,
+        copy it before changing it.
+        """
+        return pd.DataFrame(self.data[:self.rows], columns=self.columns, copy=False)
@@ -0,0 +1,225 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+
+'''
+Columnar on-disk store of the results of a sweep.
+
+A store is a directory holding one .npy array per column of the collected data, the parameter key of every
+run, and the offsets of the rows of every run:
+
+    meta.json       names of the key columns (and which ones are integers), of the data columns and of the
+                    telemetry columns
+    keys.npy        (runs, key columns) parameter key of every run, e.g. (forager_royal_ratio, growth_factor,
+                    resource_variability, seed, iteration)
+    offsets.npy     (runs + 1,) rows of run i are offsets[i]:offsets[i + 1]
+    row.npy         index of every row in the DataFrame of its run
+    column_<j>.npy  values of data column j
+    telemetry_<j>.npy   (runs,) telemetry column j of every run (see telemetry.py), if recorded
+
+All the arrays can be memory-mapped, so a single run or a few parameter keys can be read without loading
+the whole sweep.
+'''
+
+
+def _write_arrays(path, key_names, integer_keys, columns, keys, offsets, row, values, telemetry=None):
+    '''
+    Writes the arrays of a store, values holds one array per column and telemetry one array per
+    telemetry column.
+    '''
+    telemetry = telemetry or {}
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "keys.npy"), keys)
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+    np.save(os.path.join(path, "row.npy"), row)
+    for j, column_values in enumerate(values):
+        np.save(os.path.join(path, f"column_{j}.npy"), column_values)
+    for j, telemetry_values in enumerate(telemetry.values()):
+        np.save(os.path.join(path, f"telemetry_{j}.npy"), telemetry_values)
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"key_names": list(key_names), "integer_keys": integer_keys, "columns": columns,
+                   "telemetry": list(telemetry)}, f)
+
+
+def write_results(path, results, key_names, telemetry=None):
+    '''
+    Writes the results of a sweep as a store.
+
+    Args:
+        path (str): directory of the store, created if needed.
+        results (dict): {key tuple: DataFrame}, as BatchRunnerMP.get_collector_model.
+        key_names (list(str)): name of every element of the keys.
+        telemetry (dict): {key tuple: {column: value}}, as BatchRunnerMP.telemetry; runs without
+            telemetry get NaN.
+    '''
+    keys = list(results)
+    frames = [results[key] for key in keys]
+    columns = list(frames[0].columns) if frames else []
+    lengths = np.array([len(frame) for frame in frames], dtype=np.int64)
+    offsets = np.zeros(len(frames) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    row = (np.concatenate([frame.index.to_numpy(dtype=np.int64) for frame in frames]) if frames
+           else np.zeros(0, dtype=np.int64))
+    values = []
+    for column in columns:
+        column_values = np.concatenate([frame[column].to_numpy() for frame in frames])
+        if column_values.dtype == object:
+            column_values = pd.to_numeric(column_values).astype(np.float64)
+        values.append(column_values)
+    # the keys are stored as floats, the integer ones (seed, iteration) are converted back when read
+    integer_keys = [name for i, name in enumerate(key_names)
+                    if keys and all(isinstance(key[i], (int, np.integer)) for key in keys)]
+    telemetry_columns = list(next(iter(telemetry.values()))) if telemetry else []
+    telemetry_values = {column: np.array([telemetry.get(key, {}).get(column, np.nan) for key in keys],
+                                         dtype=np.float64)
+                        for column in telemetry_columns}
+    _write_arrays(path, key_names, integer_keys, columns,
+                  np.array(keys, dtype=np.float64).reshape(len(keys), len(key_names)), offsets, row, values,
+                  telemetry_values)
+
+
+def merge_results(paths, path):
+    '''
+    Writes the runs of several stores with the same columns (e.g. the shards of a sweep) as one store.
+
+    Args:
+        paths (list(str)): directories of the stores to merge, their runs are kept in this order.
+        path (str): directory of the merged store.
+    '''
+    stores = [ResultStore(store_path) for store_path in paths]
+    first = stores[0]
+    for store in stores[1:]:
+        if store.key_names != first.key_names or store.columns != first.columns:
+            raise ValueError(f"{store.path} does not have the keys and columns of {first.path}")
+    lengths = np.concatenate([np.diff(store.offsets) for store in stores])
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    integer_keys = [name for name in first.key_names if all(name in store.integer_keys for store in stores)]
+    # the telemetry is kept if all the stores have it
+    telemetry_columns = [column for column in first.telemetry_columns
+                         if all(column in store.telemetry_columns for store in stores)]
+    _write_arrays(path, first.key_names, integer_keys, first.columns,
+                  np.concatenate([store.keys for store in stores]), offsets,
+                  np.concatenate([store.row for store in stores]),
+                  [np.concatenate([store.values[column] for store in stores]) for column in first.columns],
+                  {column: np.concatenate([store.telemetry[column] for store in stores])
+                   for column in telemetry_columns})
+
+
+class ResultStore:
+    def __init__(self, path, mmap=True):
+        '''
+        Read access to a store written by write_results.
+
+        Args:
+            path (str): directory of the store.
+            mmap (bool): whether to memory-map the arrays instead of reading them.
+        '''
+        self.path = path
+        mode = "r" if mmap else None
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.key_names = meta["key_names"]
+        self.integer_keys = meta["integer_keys"]
+        self.columns = meta["columns"]
+        self.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode=mode)
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode=mode)
+        self.row = np.load(os.path.join(path, "row.npy"), mmap_mode=mode)
+        self.values = {column: np.load(os.path.join(path, f"column_{j}.npy"), mmap_mode=mode)
+                       for j, column in enumerate(self.columns)}
+        # stores written before the telemetry was recorded have none
+        self.telemetry_columns = meta.get("telemetry", [])
+        self.telemetry = {column: np.load(os.path.join(path, f"telemetry_{j}.npy"), mmap_mode=mode)
+                          for j, column in enumerate(self.telemetry_columns)}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def find(self, **key):
+        '''
+        Indices of the runs matching the given key values, e.g. find(forager_royal_ratio=0.5, seed=3).
+        The key columns not given match any value.
+        '''
+        mask = np.ones(len(self.keys), dtype=bool)
+        for name, value in key.items():
+            mask &= self.keys[:, self.key_names.index(name)] == value
+        return np.flatnonzero(mask)
+
+    def run(self, key):
+        '''
+        DataFrame of the run with the given full key, as in the results of the batch runner.
+
+        Args:
+            key (tuple): parameter key of the run.
+        '''
+        runs = self.find(**dict(zip(self.key_names, key)))
+        if len(runs) == 0:
+            raise KeyError(key)
+        start, end = self.offsets[runs[0]], self.offsets[runs[0] + 1]
+        return pd.DataFrame({column: np.asarray(self.values[column][start:end]) for column in self.columns},
+                            index=np.asarray(self.row[start:end]))
+
+    def _key_columns(self, run_of_row):
+        return {name: self.keys[run_of_row, i].astype(np.int64 if name in self.integer_keys else np.float64)
+                for i, name in enumerate(self.key_names)}
+
+    def telemetry_dataframe(self):
+        '''
+        Telemetry of every run (see telemetry.py), one line per run with the key columns.
+        '''
+        data = self._key_columns(np.arange(len(self.keys)))
+        for column in self.telemetry_columns:
+            data[column] = np.asarray(self.telemetry[column])
+        return pd.DataFrame(data)
+
+    def to_dataframe(self, runs=None):
+        '''
+        Single DataFrame of the given runs (all by default), one line per collected row, with the key
+        columns and a Row column (index of the row in the DataFrame of its run).
+
+        Args:
+            runs (np.ndarray): indices of the runs, e.g. from find.
+        '''
+        if runs is None:
+            rows = slice(None)
+            run_of_row = np.repeat(np.arange(len(self.keys)), np.diff(self.offsets))
+        else:
+            runs = np.asarray(runs, dtype=np.int64)
+            starts, lengths = self.offsets[runs], self.offsets[runs + 1] - self.offsets[runs]
+            run_of_row = np.repeat(runs, lengths)
+            # rows of every run, one run after the other
+            rows = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        data = self._key_columns(run_of_row)
+        data["Row"] = np.asarray(self.row[rows])
+        for column in self.columns:
+            data[column] = np.asarray(self.values[column][rows])
+        return pd.DataFrame(data)
+
+
+def load_results(paths, mmap=True):
+    '''
+    Single DataFrame with all the runs of one or more stores (e.g. one per seed), see ResultStore.to_dataframe.
+
+    Args:
+        paths (str or list(str)): directories of the stores.
+        mmap (bool): whether to memory-map the arrays.
+    '''
+    if isinstance(paths, str):
+        paths = [paths]
+    return pd.concat([ResultStore(path, mmap).to_dataframe() for path in paths], ignore_index=True)
+
+
+def load_telemetry(paths, mmap=True):
+    '''
+    Single DataFrame with the telemetry of all the runs of one or more stores, see
+    ResultStore.telemetry_dataframe and telemetry.slowest_regions.
+
+    Args:
+        paths (str or list(str)): directories of the stores.
+        mmap (bool): whether to memory-map the arrays.
+    '''
+    if isinstance(paths, str):
+        paths = [paths]
+    return pd.concat([ResultStore(path, mmap).telemetry_dataframe() for path in paths], ignore_index=True)
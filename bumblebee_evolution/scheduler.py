@@ -0,0 +1,103 @@
+from mesa.time import BaseScheduler
+
+'''
+Scheduler of the bees.
+
+Only the active bees are stepped, in a random order. Bees with nothing to do put themselves to sleep,
+either for a number of steps (e.g. the step after collecting) or until they are woken up (e.g. a queen
+resting in the hive until the end of the day). After the bees, the batch phases (encounters, nectar
+replenishment) run once per step.
+'''
+
+
+class ActiveSetActivation(BaseScheduler):
+    def __init__(self, model):
+        """
+        Args:
+            model (BeeEvolutionModel): the model being scheduled.
+        """
+        super().__init__(model)
+        self.active = {}
+        self.alarms = {} # step -> agents to wake up at the start of that step
+        self.phases = []
+
+    def add(self, agent):
+        """
+        Adds an agent to the schedule, the agent is active.
+
+        Args:
+            agent (Agent): agent to add, it must have a step method.
+        """
+        super().add(agent)
+        self.active[agent.unique_id] = agent
+
+    def remove(self, agent):
+        """
+        Removes an agent from the schedule, active or not.
+
+        Args:
+            agent (Agent): agent to remove.
+        """
+        super().remove(agent)
+        self.active.pop(agent.unique_id, None)
+
+    def add_phase(self, phase):
+        """
+        Adds a function without arguments, run once per step after the agents, in the order added.
+
+        Args:
+            phase (callable): function to run.
+        """
+        self.phases.append(phase)
+
+    def sleep(self, agent, steps=None):
+        """
+        Stops stepping an agent. When the steps are over, the on_wake method of the agent is called
+        in place of the skipped steps.
+
+        Args:
+            agent (Agent): agent to put to sleep.
+            steps (int): number of steps to skip, by default until the agent is woken up.
+        """
+        self.active.pop(agent.unique_id, None)
+        if steps is not None:
+            # sleeping during the current step does not count as a skipped step
+            self.alarms.setdefault(self.steps + steps + 1, []).append(agent)
+
+    def wake(self, agent):
+        """
+        Steps an agent again, from the next step.
+
+        Args:
+            agent (Agent): agent to wake up.
+        """
+        if agent.unique_id in self._agents:
+            self.active[agent.unique_id] = self._agents[agent.unique_id]
+
+    def wake_all(self):
+        """
+        Wakes up all the agents.
+        """
+        self.active = dict(self._agents)
+        self.alarms = {}
+
+    def step(self):
+        """
+        Steps the active agents in a random order, then runs the phases.
+        """
+        for agent in self.alarms.pop(self.steps, ()):
+            if agent.unique_id in self._agents and agent.unique_id not in self.active:
+                agent.on_wake()
+                self.active[agent.unique_id] = agent
+
+        agent_keys = list(self.active.keys())
+        self.model.random.shuffle(agent_keys)
+        for key in agent_keys:
+            # agents removed or put to sleep earlier in the step are skipped
+            if key in self.active:
+                self.active[key].step()
+
+        for phase in self.phases:
+            phase()
+        self.steps += 1
+        self.time += 1
@@ -0,0 +1,103 @@
+import time
+import numpy as np
+import pandas as pd
+
+'''
+Performance telemetry of the runs of a sweep, recorded by the batch runners for every run:
+
+    Wall Time (s)           duration of the run
+    CPU Time (s)            CPU time of the process running it
+    Steps                   steps actually run (a model skipping its extinct days runs fewer)
+    Peak Bees               largest number of living bees
+    Peak RSS (MB)           largest resident memory of the process during the run, NaN where the peak can
+                            not be reset before the run (only Linux can)
+    End Of Day Time (s)     time spent in the end of day processing of the hives
+
+The model statistics (steps, bees, end of day time) are read from the telemetry dict of the model, see
+BeeEvolutionModel; for other models they are NaN, and the steps are the steps of the schedule.
+'''
+
+COLUMNS = ["Wall Time (s)", "CPU Time (s)", "Steps", "Peak Bees", "Peak RSS (MB)", "End Of Day Time (s)"]
+
+
+def reset_peak_rss():
+    '''
+    Resets the peak resident memory of this process to its current resident memory, through
+    /proc/self/clear_refs on Linux.
+
+    Returns:
+        bool: whether the peak was reset; where it can not be, the peak is the one of the whole life of the
+            process (getrusage's ru_maxrss), which says nothing of a single run.
+    '''
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    '''
+    Peak resident memory of this process in MB since the last reset_peak_rss (VmHWM of
+    /proc/self/status), NaN where it can not be read.
+    '''
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2**10
+    except OSError:
+        pass
+    return np.nan
+
+
+def measure_run(run, model):
+    '''
+    Runs a model and records its telemetry.
+
+    Args:
+        run (callable): function running the model, e.g. FixedBatchRunner.run_model.
+        model (Model): model to run.
+
+    Returns:
+        the result of run(model), and the telemetry of the run as a dict with the COLUMNS.
+    '''
+    # the model is built already, its memory is part of the peak
+    reset = reset_peak_rss()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    result = run(model)
+    wall, cpu = time.perf_counter() - start_wall, time.process_time() - start_cpu
+
+    stats = getattr(model, "telemetry", {})
+    return result, {"Wall Time (s)": wall,
+                    "CPU Time (s)": cpu,
+                    "Steps": stats.get("steps", model.schedule.steps),
+                    "Peak Bees": stats.get("peak_bees", np.nan),
+                    "Peak RSS (MB)": peak_rss() if reset else np.nan,
+                    "End Of Day Time (s)": stats.get("end_of_day_time", np.nan)}
+
+
+def slowest_regions(telemetry, parameters, bins=4, by="Wall Time (s)", top=10):
+    '''
+    Report of the slowest regions of the parameter space: every parameter is cut in bins of equal width,
+    and the runs are grouped by the bins of all the parameters.
+
+    Args:
+        telemetry (pd.DataFrame): one line per run, with the parameters and the COLUMNS, e.g.
+            BatchRunnerMP.get_telemetry_dataframe or result_store.load_telemetry.
+        parameters (list(str)): parameters defining the regions.
+        bins (int): number of bins of every parameter.
+        by (str): telemetry column ranking the regions, by its mean.
+        top (int): number of regions in the report.
+
+    Returns:
+        pd.DataFrame: one line per region, the slowest first, with the number of runs and the mean and
+            largest values of the telemetry.
+    '''
+    regions = [pd.cut(telemetry[name], bins) for name in parameters]
+    columns = [column for column in COLUMNS if column in telemetry]
+    report = telemetry.groupby(regions, observed=True)[columns].agg(["mean", "max"])
+    report.columns = [f"{stat} {column}" for column, stat in report.columns]
+    report.insert(0, "Runs", telemetry.groupby(regions, observed=True).size())
+    return report.sort_values(f"mean {by}", ascending=False).head(top)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the model are imported from their directory, as run.py and batch_run.py do
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from model import BeeEvolutionModel
+
+'''
+Statistical comparison of the object engine and the vectorized engine of the BeeEvolutionModel.
+'''
+
+
+def daily_data(seeds, vectorized, **model_parameters):
+    """
+    Daily data of the runs of the given seeds with one of the engines.
+
+    Returns:
+        pd.DataFrame: one row per run and day, indexed by Run and Day.
+    """
+    data = []
+    for seed in seeds:
+        model = BeeEvolutionModel(seed=seed, vectorized=vectorized, daily_data_collection=True,
+                                  **model_parameters)
+        while model.running:
+            model.step()
+        data.append(model.datacollector.get_model_vars_dataframe())
+    return pd.concat(data, keys=range(len(data)), names=["Run", "Day"]).astype(float)
+
+
+def compare_engines(seeds, tolerance=3.0, **model_parameters):
+    """
+    Runs the object engine and the vectorized engine over many seeds and compares the mean of every
+    daily population statistic.
+
+    The engines do not draw the same random numbers, so the comparison is statistical: for every day and
+    reporter the difference between the two means is divided by its standard error, and it is within
+    tolerance when the absolute value is at most `tolerance` standard errors.
+
+    Args:
+        seeds (iterable(int)): random seeds, each one is run with both engines.
+        tolerance (float): number of standard errors allowed between the means.
+        model_parameters: parameters passed to BeeEvolutionModel.
+
+    Returns:
+        pd.DataFrame: one row per day and reporter with the means of both engines, the standardised
+            difference and whether it is within tolerance.
+    """
+    model_parameters = {"forager_royal_ratio": 0.5, "growth_factor": 0.5, "resource_variability": 0.25,
+                        **model_parameters}
+    grouped = {vectorized: daily_data(seeds, vectorized, **model_parameters).groupby(level="Day")
+               for vectorized in (False, True)}
+    mean = {vectorized: group.mean().stack() for vectorized, group in grouped.items()}
+    sem = {vectorized: group.sem().stack() for vectorized, group in grouped.items()}
+    comparison = pd.DataFrame({"object": mean[False], "vectorized": mean[True]})
+    standard_error = np.sqrt(sem[False]**2 + sem[True]**2)
+    difference = comparison["vectorized"] - comparison["object"]
+    comparison["z"] = (difference / standard_error).where(standard_error > 0, np.where(difference == 0, 0.0, np.inf))
+    comparison["within_tolerance"] = comparison["z"].abs() <= tolerance
+    return comparison
@@ -0,0 +1,14 @@
+import numpy as np
+from adaptive_sobol import converged
+
+
+def test_converged_compares_the_full_width_of_the_intervals():
+    # intervals S1 +- 0.03: 0.06 wide
+    Si = {"S1_conf": np.array([0.03, 0.01]), "ST_conf": np.array([0.02, 0.01])}
+    assert not converged(Si, 0.05)
+    assert converged(Si, 0.07)
+
+
+def test_undefined_intervals_are_not_converged():
+    Si = {"S1_conf": np.array([np.nan, 0.01]), "ST_conf": np.array([0.01, 0.01])}
+    assert not converged(Si, 1.0)
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from SALib.analyze import sobol
+from SALib.sample import saltelli
+from analysis import PROBLEM, PARAMETERS, bootstrap_seed, sobol_indices
+from batchrunner import spawn_seeds
+from result_store import write_results
+
+KEY_NAMES = PARAMETERS + ["N_days", "daily_steps", "seed", "iteration"]
+ITERATIONS = 2
+
+
+def sample_with_duplicates():
+    # the Saltelli sample of 4 base points has a point twice
+    rows = saltelli.sample(PROBLEM, 4, calc_second_order=False)
+    assert len({tuple(row) for row in rows}) < len(rows)
+    return [dict(zip(PARAMETERS, (float(value) for value in row))) for row in rows]
+
+
+def write_sweep(path, sample, order=1):
+    """
+    Writes a store of the runs of the sample as make_batch does, the output of a run is its position in the
+    batch, so that every run has its own value. With order=-1 the runs are written in the reverse order.
+    """
+    seeds = spawn_seeds(0, len(sample) * ITERATIONS)
+    runs = [(point, iteration) for point in sample for iteration in range(ITERATIONS)]
+    results = {}
+    for position in range(len(runs))[::order]:
+        point, iteration = runs[position]
+        key = tuple(point.values()) + (5, 100, seeds[position], iteration)
+        results[key] = pd.DataFrame({"Total Fertilized Queens": [0, position]})
+    write_results(path, results, KEY_NAMES)
+    return np.arange(len(runs), dtype=np.float64).reshape(len(sample), ITERATIONS)
+
+
+def test_sobol_indices_with_duplicated_points(tmp_path):
+    sample = sample_with_duplicates()
+    outputs = write_sweep(str(tmp_path / "data_0"), sample)
+
+    indices = sobol_indices(str(tmp_path / "data_0"), sample, daily=False, processes=1)
+
+    # the replicates are analysed as copies of the sample, one after the other
+    Si = sobol.analyze(PROBLEM, outputs.T.reshape(-1), calc_second_order=False, seed=bootstrap_seed(0))
+    for order in ("S1", "ST"):
+        table = indices[indices["order"] == order].set_index("parameter").loc[PARAMETERS]
+        assert np.allclose(table["index"], Si[order])
+        assert np.allclose(table["conf"], Si[f"{order}_conf"])
+
+
+def test_sobol_indices_rejects_unordered_runs_with_duplicated_points(tmp_path):
+    sample = sample_with_duplicates()
+    write_sweep(str(tmp_path / "data_0"), sample, order=-1)
+
+    with pytest.raises(ValueError, match="not in the order of the batch"):
+        sobol_indices(str(tmp_path / "data_0"), sample, daily=False, processes=1)
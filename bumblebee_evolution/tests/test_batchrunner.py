@@ -0,0 +1,17 @@
+from batchrunner import BatchRunnerMP
+from model import BeeEvolutionModel
+
+POINT = {"forager_royal_ratio": 0.5, "growth_factor": 0.5, "resource_variability": 0.25}
+
+
+def test_runs_longer_than_max_steps_reach_their_last_day():
+    # 3 days of 500 steps, more than the default max_steps of 1000
+    batch = BatchRunnerMP(BeeEvolutionModel, nr_processes=1, root_seed=0, variable_parameters=[POINT],
+                          fixed_parameters={"N_days": 3, "daily_steps": 500, "daily_data_collection": True},
+                          display_progress=False)
+    batch.run_all()
+    [telemetry] = batch.telemetry.values()
+    [data] = batch.get_collector_model().values()
+    assert telemetry["Steps"] == 1500
+    # the initial row, one row per day and the final row
+    assert len(data) == 3 + 2
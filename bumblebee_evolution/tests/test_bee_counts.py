@@ -0,0 +1,33 @@
+import pytest
+from agents import ROLES
+from model import BeeEvolutionModel
+
+
+def bee_ids(model):
+    if model.vectorized:
+        engine = model.engine
+        return set(engine.uid[:engine.size][engine.alive[:engine.size]].tolist())
+    return {agent.unique_id for agent in model.schedule_bees_and_flower_patches.agents
+            if isinstance(agent, tuple(ROLES))}
+
+
+# without growth, the bees added at the end of a day are role changes, with growth spawns too
+@pytest.mark.parametrize("growth_factor", [0.0, 0.5])
+@pytest.mark.parametrize("vectorized", [False, True])
+def test_bee_counters_match_recount(monkeypatch, vectorized, growth_factor):
+    monkeypatch.setattr(BeeEvolutionModel, "check_bee_counts", True)
+    model = BeeEvolutionModel(forager_royal_ratio=0.5, growth_factor=growth_factor, resource_variability=0.25,
+                              seed=1, N_days=4, daily_steps=100, vectorized=vectorized)
+    added = removed = 0
+    ids = bee_ids(model)
+    while model.running:
+        model.step()
+        # every counter is compared with a recount when it is read
+        for hive in [None] + model.hives:
+            for bee_type in ROLES:
+                model.count_bees(bee_type, hive)
+        new_ids = bee_ids(model)
+        added += len(new_ids - ids)
+        removed += len(ids - new_ids)
+        ids = new_ids
+    assert added > 0 and removed > 0
@@ -0,0 +1,14 @@
+from engines import compare_engines
+
+# short runs, so that 20 seeds of both engines run in seconds
+SHORT_RUN = {"N_days": 5, "daily_steps": 100}
+
+
+def test_vectorized_engine_matches_object_engine():
+    comparison = compare_engines(range(20), **SHORT_RUN)
+    assert comparison["within_tolerance"].all(), comparison[~comparison["within_tolerance"]]
+
+
+def test_vectorized_engine_matches_object_engine_in_scarce_resources():
+    comparison = compare_engines(range(20), resource_variability=0.5, growth_factor=0.1, **SHORT_RUN)
+    assert comparison["within_tolerance"].all(), comparison[~comparison["within_tolerance"]]
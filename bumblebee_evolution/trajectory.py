@@ -0,0 +1,175 @@
+import json
+import os
+import numpy as np
+import pandas as pd
+from agents import ROLES
+
+'''
+Trajectories of the bees, recorded with BeeEvolutionModel(..., trajectory_path=path) for offline analysis
+and replay.
+
+After every step, one record per living bee is added: the step, the unique_id of the bee, its position, role
+and hive. The records of a day are kept in memory and written at the end of the day, so the trajectory of
+the whole run is never in memory:
+
+    meta.json               grid size, daily_steps, hive positions, role names and recorded days
+    day_<d>.npy             records of day d (RECORD), frame after frame
+    day_<d>_frames.npy      (daily_steps + 1,) records of the i-th step of the day are frames[i]:frames[i + 1]
+
+The role is the index of the role in ROLES, the hive the index of the hive in model.hives. A bee changing
+role at the end of a day is a new bee, with a new unique_id.
+
+Only the days with living bees are written: once the colonies are extinct, the remaining days are skipped
+(see BeeEvolutionModel.skip_to_end) and have no files. The reader returns no records for them.
+'''
+
+RECORD = np.dtype([("step", np.int32), ("uid", np.int32), ("x", np.int16), ("y", np.int16),
+                   ("role", np.uint8), ("hive", np.uint8)])
+
+
+class TrajectoryRecorder:
+    def __init__(self, path, model):
+        """
+        Args:
+            path (str): directory of the trajectory, created if needed.
+            model (BeeEvolutionModel): the recorded model, with its hives set up.
+        """
+        self.path = path
+        self.model = model
+        self.hive_index = {hive: i for i, hive in enumerate(model.hives)}
+        self.frames = []
+        self.days = []
+        os.makedirs(path, exist_ok=True)
+        self._write_meta()
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump({"width": self.model.width, "height": self.model.height,
+                       "daily_steps": self.model.daily_steps,
+                       "hive_positions": [[int(x), int(y)] for x, y in self.model.hive_positions],
+                       "roles": [role.__name__ for role in ROLES], "days": self.days}, f)
+
+    def record(self):
+        """
+        Adds the frame of the current step, a phase of the scheduler run after the bees.
+        """
+        model = self.model
+        if model.vectorized:
+            engine = model.engine
+            alive = np.flatnonzero(engine.alive[:engine.size])
+            frame = np.empty(len(alive), dtype=RECORD)
+            frame["uid"] = engine.uid[alive]
+            frame["x"] = engine.x[alive]
+            frame["y"] = engine.y[alive]
+            frame["role"] = engine.role[alive]
+            frame["hive"] = engine.hive[alive]
+        else:
+            bees = list(model.schedule_bees_and_flower_patches._agents.values())
+            frame = np.empty(len(bees), dtype=RECORD)
+            frame["uid"] = [bee.unique_id for bee in bees]
+            frame["x"] = [bee.pos[0] for bee in bees]
+            frame["y"] = [bee.pos[1] for bee in bees]
+            frame["role"] = [ROLES.index(bee.bee_type) for bee in bees]
+            frame["hive"] = [self.hive_index[bee.hive] for bee in bees]
+        # the step is counted from 1, the scheduler steps count from 0
+        frame["step"] = model.schedule.steps + 1
+        self.frames.append(frame)
+
+    def end_day(self):
+        """
+        Writes the frames of the day that just ended.
+        """
+        if not self.frames:
+            return
+        day = (self.model.step_count - 1) // self.model.daily_steps
+        frames = np.zeros(len(self.frames) + 1, dtype=np.int64)
+        np.cumsum([len(frame) for frame in self.frames], out=frames[1:])
+        np.save(os.path.join(self.path, f"day_{day}.npy"), np.concatenate(self.frames))
+        np.save(os.path.join(self.path, f"day_{day}_frames.npy"), frames)
+        self.frames = []
+        self.days.append(day)
+        self._write_meta()
+
+
+class TrajectoryReader:
+    def __init__(self, path, mmap=True):
+        """
+        Read access to a trajectory written by TrajectoryRecorder.
+
+        Args:
+            path (str): directory of the trajectory.
+            mmap (bool): whether to memory-map the days instead of reading them.
+        """
+        self.path = path
+        self.mode = "r" if mmap else None
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        self.width, self.height = meta["width"], meta["height"]
+        self.daily_steps = meta["daily_steps"]
+        self.hive_positions = [tuple(pos) for pos in meta["hive_positions"]]
+        self.roles = meta["roles"]
+        self.days = meta["days"]
+
+    def day(self, day):
+        """
+        Records of a day, frame after frame; no records for a day that was not written (e.g. skipped after
+        the extinction of the colonies).
+
+        Args:
+            day (int): day, from 0.
+        """
+        if day not in self.days:
+            return np.zeros(0, dtype=RECORD)
+        return np.load(os.path.join(self.path, f"day_{day}.npy"), mmap_mode=self.mode)
+
+    def frame(self, step):
+        """
+        Records of the bees after the given step; no records for a step of a day that was not written.
+
+        Args:
+            step (int): step of the run, from 1.
+        """
+        day, i = divmod(step - 1, self.daily_steps)
+        if day not in self.days:
+            return np.zeros(0, dtype=RECORD)
+        frames = np.load(os.path.join(self.path, f"day_{day}_frames.npy"))
+        return self.day(day)[frames[i]:frames[i + 1]]
+
+    def _select(self, field, value, days):
+        days = self.days if days is None else days
+        parts = []
+        for day in days:
+            records = self.day(day)
+            parts.append(np.asarray(records[records[field] == value]))
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=RECORD)
+
+    def bee(self, uid, days=None):
+        """
+        Records of a bee, in the order of the steps.
+
+        Args:
+            uid (int): unique_id of the bee.
+            days (list(int)): days to read, all by default.
+        """
+        return self._select("uid", uid, days)
+
+    def hive(self, hive, days=None):
+        """
+        Records of the bees of a hive, frame after frame.
+
+        Args:
+            hive (int): index of the hive.
+            days (list(int)): days to read, all by default.
+        """
+        return self._select("hive", hive, days)
+
+    def to_dataframe(self, records):
+        """
+        DataFrame of records, with the name of the role.
+
+        Args:
+            records (np.ndarray): records, e.g. from day, frame, bee or hive.
+        """
+        df = pd.DataFrame(np.asarray(records))
+        df["role"] = pd.Categorical.from_codes(df["role"], self.roles)
+        return df
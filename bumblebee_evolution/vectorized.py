@@ -0,0 +1,424 @@
+import numpy as np
+from agents import ROLES
+from encounters import cooccurring_pairs, role_probabilities, draw_roles
+
+'''
+Array-backed engine for the BeeEvolutionModel, selected with BeeEvolutionModel(..., vectorized=True).
+
+Instead of one Bee agent per bee, the state of the whole population is stored in NumPy arrays
+(position, role, hive index, health_level, stored_nectar, isCollecting and last_resource) and all the
+bees of a role are advanced with batched array operations. Within a step all the bees act on the state
+at the beginning of the step; conflicts (several bees on the same flower patch, several queens on the
+same drone) are resolved in a random order, as the random activation of the object engine does.
+Encounters are recorded for the bees that share a cell at the end of each step.
+'''
+
+# roles, the index in ROLES is the role code stored in the arrays
+WORKER, DRONE, QUEEN = range(len(ROLES))
+
+# same defaults as the agent classes
+NECTAR_NEEDED = np.array([236.0, 236.0, 740.0])
+WORKER_MAX_NECTAR = 44
+
+
+class VectorizedEngine:
+    def __init__(self, model, capacity=256):
+        """
+        Args:
+            model (BeeEvolutionModel): the model being simulated.
+            capacity (int): number of bees allocated up front, the arrays grow when needed.
+        """
+        self.model = model
+        self.hives = []
+        self.hive_x = np.zeros(0, dtype=np.int64)
+        self.hive_y = np.zeros(0, dtype=np.int64)
+        self.hive_nectar = np.zeros(0)
+        # number of living bees of every role in every hive, kept up to date by add_bees and _kill
+        self.counts = np.zeros((0, len(ROLES)), dtype=np.int64)
+
+        self.size = 0
+        self.uid = np.zeros(capacity, dtype=np.int64)
+        self.role = np.zeros(capacity, dtype=np.int8)
+        self.hive = np.zeros(capacity, dtype=np.int64)
+        self.x = np.zeros(capacity, dtype=np.int64)
+        self.y = np.zeros(capacity, dtype=np.int64)
+        self.health_level = np.zeros(capacity)
+        self.stored_nectar = np.zeros(capacity)
+        self.isCollecting = np.zeros(capacity, dtype=bool)
+        # last_resource is stored as two coordinates, -1 meaning no resource
+        self.last_x = np.full(capacity, -1, dtype=np.int64)
+        self.last_y = np.full(capacity, -1, dtype=np.int64)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    _bee_arrays = ("uid", "role", "hive", "x", "y", "health_level", "stored_nectar",
+                   "isCollecting", "last_x", "last_y", "alive")
+
+    def add_hive(self, hive):
+        """
+        Registers a hive, its index is used in the hive array of the bees.
+
+        Args:
+            hive (Hive): hive agent already placed in the environment.
+        """
+        self.hives.append(hive)
+        self.hive_x = np.append(self.hive_x, int(hive.pos[0]))
+        self.hive_y = np.append(self.hive_y, int(hive.pos[1]))
+        self.hive_nectar = np.append(self.hive_nectar, float(hive.nectar_units))
+        self.counts = np.vstack((self.counts, np.zeros((1, len(ROLES)), dtype=np.int64)))
+        return len(self.hives) - 1
+
+    def _grow(self, needed):
+        """
+        Makes sure that the arrays can hold at least `needed` bees.
+        """
+        capacity = len(self.alive)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name in self._bee_arrays:
+            old = getattr(self, name)
+            new = np.full(capacity, -1 if name in ("last_x", "last_y") else 0, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def add_bees(self, roles, hive_i, x=None, y=None, last_x=None, last_y=None):
+        """
+        Adds new bees to a hive, with empty health and no stored nectar.
+
+        Args:
+            roles (np.ndarray): role codes of the new bees.
+            hive_i (int): index of the hive of the new bees.
+            x, y (np.ndarray): positions of the new bees, by default the hive position.
+            last_x, last_y (np.ndarray): last resource of the new bees, by default none.
+        """
+        count = len(roles)
+        self._grow(self.size + count)
+        new = slice(self.size, self.size + count)
+        self.uid[new] = np.arange(self.model.current_id + 1, self.model.current_id + 1 + count)
+        self.model.current_id += count
+        self.role[new] = roles
+        self.hive[new] = hive_i
+        self.x[new] = self.hive_x[hive_i] if x is None else x
+        self.y[new] = self.hive_y[hive_i] if y is None else y
+        self.health_level[new] = 0
+        self.stored_nectar[new] = 0
+        self.isCollecting[new] = False
+        self.last_x[new] = -1 if last_x is None else last_x
+        self.last_y[new] = -1 if last_y is None else last_y
+        self.alive[new] = True
+        self.size += count
+        self.counts[hive_i] += np.bincount(self.role[new], minlength=len(ROLES))
+
+    def _kill(self, idx):
+        """
+        Marks the bees at the given indices as dead.
+
+        Args:
+            idx (np.ndarray or int): indices of living bees.
+        """
+        self.alive[idx] = False
+        np.subtract.at(self.counts, (self.hive[idx], self.role[idx]), 1)
+
+    def count(self, bee_type=None, hive=None):
+        """
+        Number of living bees, optionally only of the given type and hive, from the counters.
+
+        Args:
+            bee_type (class type): type of bees
+            hive (Hive): count bees of this hive only
+        """
+        counts = self.counts if hive is None else self.counts[self.hives.index(hive)]
+        if bee_type is not None:
+            counts = counts[..., ROLES.index(bee_type)]
+        return int(counts.sum())
+
+    def recount(self, bee_type=None, hive=None):
+        """
+        Same as count, but counts the living bees from scratch.
+        """
+        mask = self.alive[:self.size]
+        if bee_type is not None:
+            mask = mask & (self.role[:self.size] == ROLES.index(bee_type))
+        if hive is not None:
+            mask = mask & (self.hive[:self.size] == self.hives.index(hive))
+        return int(np.count_nonzero(mask))
+
+    def population(self):
+        """
+        Unique ids, role codes and hive indices of the living bees.
+        """
+        alive = self.alive[:self.size]
+        return self.uid[:self.size][alive], self.role[:self.size][alive], self.hive[:self.size][alive]
+
+    def nectar_needed(self):
+        """
+        Total nectar needed per day by the living bees.
+        """
+        alive = self.alive[:self.size]
+        return NECTAR_NEEDED[self.role[:self.size][alive]].sum()
+
+    def step(self):
+        '''
+        Advances all bees by one step.
+        '''
+        n = self.size
+        role = self.role[:n]
+        hive = self.hive[:n]
+        x, y = self.x[:n], self.y[:n]
+        health = self.health_level[:n]
+        stored = self.stored_nectar[:n]
+        collecting = self.isCollecting[:n]
+        last_x, last_y = self.last_x[:n], self.last_y[:n]
+        alive = self.alive[:n]
+        needed = NECTAR_NEEDED[role]
+        hx, hy = self.hive_x[hive], self.hive_y[hive]
+        at_hive = (x == hx) & (y == hy)
+        has_last = last_x >= 0
+
+        worker = alive & (role == WORKER)
+        drone = alive & (role == DRONE)
+        queen = alive & (role == QUEEN)
+
+        # full workers drop the nectar in the hive, or go back to it
+        full_worker = worker & (stored == WORKER_MAX_NECTAR)
+        drop = full_worker & at_hive
+        if drop.any():
+            self.hive_nectar += np.bincount(hive[drop], weights=stored[drop], minlength=len(self.hives))
+            stored[drop] = 0
+
+        # queens in the hive and full on nectar do nothing
+        idle_queen = queen & at_hive & (health == needed)
+
+        # bees that collected in the previous step spend this one frozen
+        frozen = collecting & ((worker & ~full_worker) | drone | (queen & ~idle_queen))
+        collecting[frozen] = False
+
+        foraging_worker = worker & ~full_worker & ~frozen
+        moving_drone = drone & ~frozen
+        active_queen = queen & ~idle_queen & ~frozen
+        full_queen = active_queen & (health == needed)
+        hungry_queen = active_queen & ~full_queen
+
+        # full queens remember a good resource before returning to the hive
+        remember = full_queen & (self.model.nectar_field.nectar[x, y] > 0)
+        last_x[remember] = x[remember]
+        last_y[remember] = y[remember]
+
+        seeking = foraging_worker | hungry_queen
+        self._move_home(full_worker & ~at_hive | full_queen)
+        self._move_towards(seeking & has_last, last_x, last_y)
+        self._random_move(seeking & ~has_last | moving_drone)
+
+        self._mate(active_queen, drone)
+
+        # bees that did a random move, or reached their last resource, look for nectar
+        at_last = (x == last_x) & (y == last_y)
+        look = alive & ((seeking & (~has_last | at_last)) | (moving_drone & (health < needed)))
+        self._collect(look)
+
+        self._record_encounters()
+
+    def _move_home(self, mask):
+        """
+        Moves the selected bees one step towards their hive, all hives at once (see movement.NextHops).
+        """
+        idx = np.flatnonzero(mask)
+        if idx.size == 0:
+            return
+        self.x[idx], self.y[idx] = self.model.next_hops.homing(self.hive[idx], self.x[idx], self.y[idx])
+
+    def _move_towards(self, mask, target_x, target_y):
+        """
+        Moves the selected bees one step towards their target.
+        """
+        if not mask.any():
+            return
+        self.x[:self.size][mask] += np.sign(target_x[mask] - self.x[:self.size][mask])
+        self.y[:self.size][mask] += np.sign(target_y[mask] - self.y[:self.size][mask])
+
+    def _random_move(self, mask):
+        """
+        Moves the selected bees to a random cell of their Moore neighbourhood, the own hive excluded.
+        """
+        idx = np.flatnonzero(mask)
+        if idx.size == 0:
+            return
+        self.x[idx], self.y[idx] = self.model.neighbourhoods.random_neighbours(
+            self.hive[idx], self.x[idx], self.y[idx], self.model.random_moves.take(idx.size))
+
+    def _mate(self, queens, drones):
+        """
+        Mates the selected queens with a drone of another hive in the same cell, both are removed.
+        """
+        if not queens.any() or not drones.any():
+            return
+        height = self.model.height
+        cell = self.x[:self.size]*height + self.y[:self.size]
+        hive = self.hive[:self.size]
+        queen_idx = np.flatnonzero(queens)
+        drone_idx = np.flatnonzero(drones)
+
+        # drones of every hive in every cell
+        drones_per_cell = np.zeros((self.model.width*height, len(self.hives)), dtype=np.int64)
+        np.add.at(drones_per_cell, (cell[drone_idx], hive[drone_idx]), 1)
+        foreign = drones_per_cell[cell[queen_idx]].sum(axis=1) - drones_per_cell[cell[queen_idx], hive[queen_idx]]
+        candidates = queen_idx[foreign > 0]
+        if candidates.size == 0:
+            return
+
+        # pair the candidate queens in a random order, a drone mates only once
+        self.model.rng.shuffle(candidates)
+        candidate_cells = np.unique(cell[candidates])
+        drone_idx = drone_idx[np.isin(cell[drone_idx], candidate_cells)]
+        drone_idx = drone_idx[self.model.rng.permutation(drone_idx.size)]
+        drones_in_cell = {}
+        for d in drone_idx:
+            drones_in_cell.setdefault(cell[d], []).append(d)
+        for q in candidates:
+            for d in drones_in_cell[cell[q]]:
+                if self.alive[d] and hive[d] != hive[q]:
+                    self._kill([q, d])
+                    self.hives[hive[q]].number_fertilized_queens += 1
+                    break
+
+    def _collect(self, mask):
+        """
+        The selected bees collect nectar from their cell, in a random order within each cell.
+        """
+        idx = np.flatnonzero(mask)
+        if idx.size == 0:
+            return
+        idx = idx[self.model.rng.permutation(idx.size)]
+        cell = self.x[idx]*self.model.height + self.y[idx]
+        order = np.argsort(cell, kind="stable")
+        idx, cell = idx[order], cell[order]
+
+        is_worker = self.role[idx] == WORKER
+        demand = np.where(is_worker, WORKER_MAX_NECTAR - self.stored_nectar[idx],
+                          NECTAR_NEEDED[self.role[idx]] - self.health_level[idx])
+
+        # nectar requested by the bees before each bee in the same cell
+        offset = np.cumsum(demand) - demand
+        first = np.ones(idx.size, dtype=bool)
+        first[1:] = cell[1:] != cell[:-1]
+        requested_before = offset - np.maximum.accumulate(np.where(first, offset, 0))
+
+        nectar = self.model.nectar_field.nectar.reshape(-1)
+        available = nectar[cell] - requested_before
+        found = available > 0
+        amount = np.minimum(demand, np.maximum(available, 0))
+        nectar -= np.bincount(cell, weights=amount, minlength=nectar.size)
+
+        self.stored_nectar[idx[found & is_worker]] += amount[found & is_worker]
+        self.health_level[idx[found & ~is_worker]] += amount[found & ~is_worker]
+        self.isCollecting[idx[found]] = True
+
+        # workers and queens forget a resource that is no longer good
+        forget = idx[~found & (self.role[idx] != DRONE)]
+        self.last_x[forget] = -1
+        self.last_y[forget] = -1
+
+    def _record_encounters(self):
+        """
+        Stores in the encounter store the pairs of living bees sharing a cell which is not a hive.
+        """
+        n = self.size
+        x, y = self.x[:n], self.y[:n]
+        idx = np.flatnonzero(self.alive[:n] & ~self.model.is_hive_cell[x, y])
+        first, second = cooccurring_pairs(x[idx]*self.model.height + y[idx])
+        self.model.encounter_store.add(self.uid[idx[first]], self.uid[idx[second]])
+
+    def end_of_day(self):
+        '''
+        Actions of all the hives at the end of the day, same as Hive.step: feed the bees and kill the ones
+        that did not get enough nectar, generate the next generation, bring the bees back to the hives
+        and spawn new bees.
+        '''
+        for hive_i in range(len(self.hives)):
+            self._feed_and_kill_bees(hive_i)
+            self._generate_next_generation(hive_i)
+            self._bees_to_hive(hive_i)
+            self._spawn_new_bees(hive_i)
+
+        # drop dead bees and start a new day
+        keep = np.flatnonzero(self.alive[:self.size])
+        for name in self._bee_arrays:
+            array = getattr(self, name)
+            array[:len(keep)] = array[keep]
+        self.size = len(keep)
+        for hive, nectar in zip(self.hives, self.hive_nectar):
+            hive.nectar_units = float(nectar)
+
+    def _feed_and_kill_bees(self, hive_i):
+        '''
+        Feeds the bees of a hive in a random order, the ones that can not be fed die.
+        '''
+        n = self.size
+        members = np.flatnonzero(self.alive[:n] & (self.hive[:n] == hive_i))
+        is_drone = self.role[members] == DRONE
+        drones = members[is_drone]
+        self._kill(drones[self.health_level[drones] < NECTAR_NEEDED[DRONE]])
+
+        rest = members[~is_drone]
+        rest = rest[self.model.rng.permutation(rest.size)]
+        difference = NECTAR_NEEDED[self.role[rest]] - self.health_level[rest]
+        nectar = self.hive_nectar[hive_i]
+        while rest.size:
+            # the bees are fed in order until one of them can not be fed
+            fed = np.searchsorted(np.cumsum(difference), nectar, side="right")
+            if fed:
+                nectar -= difference[:fed].sum()
+            if fed == rest.size:
+                break
+            self._kill(rest[fed])
+            rest, difference = rest[fed + 1:], difference[fed + 1:]
+            if rest.size and nectar < difference.min():
+                self._kill(rest)
+                break
+        self.hive_nectar[hive_i] = nectar
+
+    def _generate_next_generation(self, hive_i):
+        '''
+        Reassigns the roles of the bees of a hive based on their encounters, same as
+        Hive.generate_next_generation.
+        '''
+        n = self.size
+        members = np.flatnonzero(self.alive[:n] & (self.hive[:n] == hive_i))
+        counts = self.model.encounter_store.counts_of(self.uid[members])
+        probabilities, change = role_probabilities(counts, self.model.parameters)
+
+        # bees without encounters, or without a valid role, only lose their health
+        self.health_level[members[~change]] = 0
+        changing = members[change]
+        if changing.size == 0:
+            return
+        new_roles = draw_roles(self.model.rng, probabilities[change])
+
+        # the old bees are replaced by new ones, which keep position and last resource
+        self._kill(changing)
+        self.add_bees(new_roles, hive_i, self.x[changing], self.y[changing],
+                      self.last_x[changing], self.last_y[changing])
+
+    def _bees_to_hive(self, hive_i):
+        '''
+        Moves all the bees of a hive, except drones, back to the hive.
+        '''
+        n = self.size
+        back = self.alive[:n] & (self.hive[:n] == hive_i) & (self.role[:n] != DRONE)
+        self.x[:n][back] = self.hive_x[hive_i]
+        self.y[:n][back] = self.hive_y[hive_i]
+
+    def _spawn_new_bees(self, hive_i):
+        """
+        Spawns new bees of random roles in a hive, until the growth nectar is spent.
+        """
+        allocated_growth_nectar = self.hive_nectar[hive_i]*self.model.parameters["growth_factor"]
+        if allocated_growth_nectar <= 0:
+            return
+        # enough draws to spend the growth nectar even if only the cheapest bees are drawn
+        roles = self.model.rng.integers(len(ROLES), size=int(allocated_growth_nectar // NECTAR_NEEDED.min()) + 1)
+        spent = np.cumsum(NECTAR_NEEDED[roles])
+        count = np.searchsorted(spent, allocated_growth_nectar, side="left") + 1
+        self.add_bees(roles[:count], hive_i)
+        self.hive_nectar[hive_i] = max(0, self.hive_nectar[hive_i] - spent[count - 1])
@@ -29,10 +29,23 @@ def agent_portrayal(agent):
             portrayal[FlowerPatch]["Color"] = "Green"
         return portrayal[FlowerPatch]
 
+class NectarCanvasGrid(CanvasGrid):
+    """
+    Canvas grid that also draws the flower patches, which are stored in the nectar field
+    of the model instead of being agents on the grid.
+    """
+    def render(self, model):
+        grid_state = super().render(model)
+        for flower_patch in model.nectar_field.flower_patches():
+            portrayal = self.portrayal_method(flower_patch)
+            portrayal["x"], portrayal["y"] = flower_patch.pos
+            grid_state[portrayal["Layer"]].append(portrayal)
+        return grid_state
+
 width = height = 25
 num_hives = 3
 
-grid = CanvasGrid(agent_portrayal, width, height, 500, 500)
+grid = NectarCanvasGrid(agent_portrayal, width, height, 500, 500)
 
 # chart for total bees
 chart_bees = ChartModule([{"Label": "Total Workers", "Color": "Blue"}, 
@@ -0,0 +1,129 @@
+import os
+import shutil
+import socket
+import time
+import uuid
+
+'''
+Work queue of the chunks of a sweep, shared by several workers (processes or machines) through a
+directory on a shared filesystem. Only atomic renames are used to claim work:
+
+    <queue>/pending/<chunk>             chunks nobody has claimed
+    <queue>/claimed/<chunk>.<worker>    chunks being run, the file is touched by its worker (lease)
+    <queue>/done/<chunk>                finished chunks
+    <queue>/logs/<chunk>.log            result log of every chunk (see batchrunner.ResultLog)
+    <queue>/results/<chunk>             result store of every finished chunk (see result_store.py)
+
+A chunk whose claim and log have not been touched for longer than the lease is claimed again by another
+worker, which resumes it from its log, so a worker dying in the middle of a chunk only loses its current run.
+'''
+
+
+class WorkQueue:
+    def __init__(self, path, lease=3600):
+        """
+        Args:
+            path (str): directory of the queue.
+            lease (float): seconds after which a claimed chunk that shows no progress can be claimed again,
+                it must be longer than one run of the model.
+        """
+        self.path = path
+        self.lease = lease
+        self.worker = f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+    def _dir(self, name):
+        return os.path.join(self.path, name)
+
+    def create(self, chunks):
+        """
+        Creates the queue with the given number of chunks, unless it already exists (e.g. created by
+        another worker).
+
+        Args:
+            chunks (int): number of chunks, named 0 to chunks - 1.
+        """
+        if os.path.exists(self.path):
+            return
+        # the queue is built aside and renamed, so that the other workers never see it half made
+        tmp = f"{self.path}.tmp-{self.worker}"
+        for name in ("pending", "claimed", "done", "logs", "results"):
+            os.makedirs(os.path.join(tmp, name))
+        for chunk in range(chunks):
+            open(os.path.join(tmp, "pending", str(chunk)), "w").close()
+        try:
+            os.rename(tmp, self.path)
+        except OSError:
+            shutil.rmtree(tmp)
+
+    def log_path(self, chunk):
+        """Path of the result log of a chunk."""
+        return os.path.join(self._dir("logs"), f"{chunk}.log")
+
+    def results_path(self, chunk):
+        """Path of the result store of a chunk."""
+        return os.path.join(self._dir("results"), str(chunk))
+
+    def _claim_path(self, chunk, worker=None):
+        return os.path.join(self._dir("claimed"), f"{chunk}.{worker or self.worker}")
+
+    def _last_progress(self, claim_path, chunk):
+        times = [os.path.getmtime(claim_path)]
+        if os.path.exists(self.log_path(chunk)):
+            times.append(os.path.getmtime(self.log_path(chunk)))
+        return max(times)
+
+    def claim(self):
+        """
+        Claims a pending chunk or, if there is none, a chunk whose lease has expired.
+
+        Returns:
+            int: the claimed chunk, None if there is nothing to claim.
+        """
+        for name in sorted(os.listdir(self._dir("pending")), key=int):
+            try:
+                os.rename(os.path.join(self._dir("pending"), name), self._claim_path(name))
+            except OSError:
+                continue # claimed by another worker in the meantime
+            self.renew(int(name))
+            return int(name)
+
+        now = time.time()
+        for name in sorted(os.listdir(self._dir("claimed"))):
+            chunk, _ = name.split(".", 1)
+            path = os.path.join(self._dir("claimed"), name)
+            try:
+                if now - self._last_progress(path, chunk) < self.lease:
+                    continue
+                os.rename(path, self._claim_path(chunk))
+            except OSError:
+                continue # finished or claimed again by another worker in the meantime
+            self.renew(int(chunk))
+            return int(chunk)
+        return None
+
+    def renew(self, chunk):
+        """Extends the lease of a chunk claimed by this worker."""
+        os.utime(self._claim_path(chunk))
+
+    def complete(self, chunk):
+        """
+        Marks a chunk claimed by this worker as done.
+
+        Returns:
+            bool: False if the chunk was claimed again by another worker (its lease expired).
+        """
+        try:
+            os.rename(self._claim_path(chunk), os.path.join(self._dir("done"), str(chunk)))
+        except OSError:
+            return False
+        return True
+
+    def unfinished(self):
+        """Chunks that are not done yet."""
+        pending = [int(name) for name in os.listdir(self._dir("pending"))]
+        claimed = [int(name.split(".", 1)[0]) for name in os.listdir(self._dir("claimed"))]
+        return sorted(pending + claimed)
+
+    def finished(self):
+        """Chunks that are done, in order."""
+        return sorted(int(name) for name in os.listdir(self._dir("done")))